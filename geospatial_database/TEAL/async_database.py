@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from final_project.TEAL import pool, queries
+
+DEFAULT_IN_FLIGHT = 16
+
+# Batches a query may run ahead of its consumer before the worker waits.
+DEFAULT_QUEUE_DEPTH = 4
+
+DONE = object()
+
+
+class QueryFailure:
+    def __init__(self, error):
+        self.error = error
+
+
+class AsyncDatabase:
+    def __init__(self, database, max_workers=None, max_in_flight=DEFAULT_IN_FLIGHT,
+                 queue_depth=DEFAULT_QUEUE_DEPTH, batch_size=queries.RESULT_BATCH_SIZE):
+        if not isinstance(database, pool.PooledDatabase):
+            raise TypeError('AsyncDatabase needs a pool.PooledDatabase so workers can share it')
+        self.database = database
+        self.executor = ThreadPoolExecutor(max_workers or database.readers.maxsize + 1,
+                                           thread_name_prefix='teal-query')
+        self.slots = asyncio.Semaphore(max_in_flight)
+        self.queue_depth = queue_depth
+        self.batch_size = batch_size
+
+    def __getattr__(self, name):
+        if name not in pool.READ_METHODS:
+            raise AttributeError(name)
+
+        def query(*args, batch_size=None):
+            return self.stream(name, *args, batch_size=batch_size)
+        return query
+
+    async def stream(self, method_name, *args, batch_size=None):
+        loop = asyncio.get_running_loop()
+        batches = asyncio.Queue()
+        credits = threading.Semaphore(self.queue_depth)
+        cancelled = threading.Event()
+        running = {'lock': threading.Lock(), 'conn': None}
+
+        async with self.slots:
+            worker = loop.run_in_executor(self.executor, self.produce, loop, batches, credits, cancelled, running,
+                                          method_name, args, batch_size or self.batch_size)
+            try:
+                while True:
+                    batch = await batches.get()
+                    if batch is DONE:
+                        break
+                    if isinstance(batch, QueryFailure):
+                        raise batch.error
+                    credits.release()
+                    yield batch
+                await worker
+            finally:
+                if not worker.done():
+                    # Stop the worker between batches, or abort the statement
+                    # it is stepping through right now.
+                    cancelled.set()
+                    credits.release()
+                    with running['lock']:
+                        if running['conn'] is not None:
+                            running['conn'].interrupt()
+
+    async def fetch(self, method_name, *args):
+        rows = []
+        async for batch in self.stream(method_name, *args):
+            rows.extend(batch)
+        return rows
+
+    async def write(self, method_name, *args):
+        async with self.slots:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, lambda: getattr(self.database, method_name)(*args))
+
+    def produce(self, loop, batches, credits, cancelled, running, method_name, args, batch_size):
+        try:
+            with self.database.reading():
+                with running['lock']:
+                    running['conn'] = self.database.conn
+                try:
+                    if not cancelled.is_set():
+                        getattr(self.database, method_name)(*args)
+                    for batch in self.database.iter_batches(batch_size):
+                        if cancelled.is_set():
+                            break
+                        while not credits.acquire(timeout=0.1):
+                            if cancelled.is_set():
+                                return
+                        loop.call_soon_threadsafe(batches.put_nowait, batch)
+                finally:
+                    # The reader goes back to the pool after this, where it
+                    # must no longer be interrupted on this query's behalf.
+                    with running['lock']:
+                        running['conn'] = None
+        except Exception as e:
+            if not cancelled.is_set():
+                loop.call_soon_threadsafe(batches.put_nowait, QueryFailure(e))
+        finally:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(batches.put_nowait, DONE)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
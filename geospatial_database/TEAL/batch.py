@@ -0,0 +1,182 @@
+import sys
+import shlex
+import time
+from collections import defaultdict
+from final_project.TEAL import predicate
+
+GROUP_COMMIT_SIZE = 1000
+
+WRITE_COMMANDS = ('insert', 'delete', 'modify', 'improve', 'reassign')
+
+# Same numbering as query_prompt.query_options.
+QUERY_METHODS = {1: 'get_land_by_county',
+                 2: 'get_land_by_area',
+                 3: 'get_land_by_owner',
+                 4: 'get_land_by_quality_rating',
+                 5: 'view_land_details',
+                 6: 'get_average_rating_county',
+                 7: 'get_area_by_owner',
+                 8: 'get_owners_in_county',
+                 9: 'get_critical_land_count_by_county',
+                 10: 'get_land_by_status',
+                 11: 'generic_query'}
+
+INSERT_METHODS = {'land': 'insert_into_land',
+                  'county': 'insert_into_county',
+                  'improvement': 'insert_into_improvement',
+                  'owner': 'insert_into_owner'}
+
+
+def parse_commands(lines):
+    for line_number, line in enumerate(lines, 1):
+        words = shlex.split(line, comments=True)
+        if words:
+            yield line_number, words[0].lower(), words[1:]
+
+
+def parse_argument(word):
+    if word.lower() in ('null', 'none', '-'):
+        return None
+    return predicate.parse_literal(word)
+
+
+class BatchRunner:
+    def __init__(self, database, group_size=GROUP_COMMIT_SIZE, echo=True):
+        self.database = database
+        self.group_size = group_size
+        self.echo = echo
+        self.pending_writes = 0
+        self.latencies = defaultdict(list)
+        self.errors = 0
+        self.commands = {'insert': self.insert,
+                         'delete': self.delete,
+                         'modify': self.modify,
+                         'improve': self.improve,
+                         'reassign': self.reassign,
+                         'search': self.search,
+                         'query': self.query,
+                         'cube': self.cube,
+                         'plan': self.plan,
+                         'commit': self.commit,
+                         'profile': self.profile,
+                         'export': self.export,
+                         'snapshot': self.snapshot}
+
+    def run(self, lines):
+        start = time.perf_counter()
+        for line_number, command, args in parse_commands(lines):
+            if command not in WRITE_COMMANDS and self.pending_writes:
+                self.commit()
+            self.database.flush()
+
+            started = time.perf_counter()
+            try:
+                if command not in self.commands:
+                    raise ValueError('unknown command ' + command)
+                self.commands[command](args)
+            except Exception as e:
+                self.errors += 1
+                print('Encountered error: ', e, 'while running line', line_number)
+            self.latencies[command].append(time.perf_counter() - started)
+
+            if command in WRITE_COMMANDS:
+                self.pending_writes += 1
+                if self.pending_writes >= self.group_size:
+                    self.commit()
+
+        if self.pending_writes:
+            self.commit()
+        return time.perf_counter() - start
+
+    def insert(self, args):
+        getattr(self.database, INSERT_METHODS[args[0].lower()])(*args[1:])
+
+    def delete(self, args):
+        if len(args) == 1:
+            self.database.delete_table(args[0].lower())
+        else:
+            self.database.delete_item(args[0].lower(), args[1], ' '.join(args[2:]))
+
+    def modify(self, args):
+        # modify <table> <column> <new value> <where column> <condition>
+        self.database.modify_item(args[0].lower(), args[3], ' '.join(args[4:]), {args[1]: parse_argument(args[2])})
+
+    def improve(self, args):
+        # improve <improvement id> <max rating> [county id]
+        self.database.apply_improvement(*[parse_argument(word) for word in args])
+
+    def reassign(self, args):
+        self.database.reassign_owner(*[parse_argument(word) for word in args])
+
+    def search(self, args):
+        self.database.generic_query(args[0].lower(), False, args[1], ' '.join(args[2:]))
+        self.write_result()
+
+    def query(self, args):
+        method = QUERY_METHODS[int(args[0])]
+        if method == 'generic_query':
+            self.database.generic_query(args[1].lower(), args[2].lower() == 'y', args[3], ' '.join(args[4:]))
+        else:
+            getattr(self.database, method)(*[parse_argument(word) for word in args[1:]])
+        self.write_result()
+
+    def cube(self, args):
+        # cube [county] [status] [rating_bucket]
+        self.database.get_land_cube(*[word.lower() for word in args])
+        self.write_result()
+
+    def plan(self, args):
+        # plan <budget> [knapsack|greedy] [rating|area] [county id] [max rating]
+        words = [parse_argument(word) for word in args[3:]]
+        self.database.plan_improvements(float(args[0]), *[word.lower() for word in args[1:3]], *words)
+        self.write_result()
+
+    def commit(self, args=None):
+        self.database.commit()
+        self.pending_writes = 0
+
+    def export(self, args):
+        # export <source> <output dir> [county_id|owner_id|none] [csv|csv.gz|csv.zst|npy] [buckets]
+        partition_by = args[2].lower() if len(args) > 2 else 'county_id'
+        self.database.export(args[0].lower(), args[1], None if partition_by == 'none' else partition_by,
+                             args[3].lower() if len(args) > 3 else 'csv.gz',
+                             buckets=int(args[4]) if len(args) > 4 else None)
+
+    def snapshot(self, args=None):
+        if not hasattr(self.database, 'snapshot'):
+            raise ValueError('snapshots need the in-memory database; run with --memory')
+        self.database.snapshot()
+
+    def profile(self, args=None):
+        if self.database.profiler is None:
+            raise ValueError('profiling is off; run with --profile')
+        if args:
+            self.database.profiler.dump(args[0])
+        else:
+            self.database.profiler.report()
+
+    def write_result(self):
+        if self.echo:
+            self.database.write_result()
+        else:
+            for _ in self.database.iter_batches():
+                pass
+
+    def report(self, elapsed):
+        total = sum(len(samples) for samples in self.latencies.values())
+        sys.stdout.write('%d commands in %.3fs (%.0f ops/sec), %d errors\n'
+                         % (total, elapsed, total / elapsed if elapsed > 0 else total, self.errors))
+        for command, samples in sorted(self.latencies.items()):
+            samples = sorted(samples)
+            sys.stdout.write('\t%-8s n=%-7d mean=%.1fus p50=%.1fus p99=%.1fus max=%.1fus\n'
+                             % (command, len(samples), 1e6 * sum(samples) / len(samples),
+                                1e6 * samples[len(samples) // 2], 1e6 * samples[int(len(samples) * 0.99)],
+                                1e6 * samples[-1]))
+
+
+def run_file(database, command_file, group_size=GROUP_COMMIT_SIZE, echo=True):
+    runner = BatchRunner(database, group_size, echo)
+    with command_file.open('r') as commands:
+        elapsed = runner.run(commands)
+    runner.report(elapsed)
+    return runner
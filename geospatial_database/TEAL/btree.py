@@ -0,0 +1,334 @@
+import mmap
+import struct
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+
+PAGE_SIZE = 4096
+
+MAGIC = b'TEALBPT1'
+
+# magic, page size, root page, height, page count, free list head, entry count
+HEADER = struct.Struct('<8sIIIIIQ')
+
+# kind, key count, next leaf (leaves) or next free page (free pages)
+NODE_HEADER = struct.Struct('<BxHI')
+
+FREE, LEAF, INTERNAL = 0, 1, 2
+
+MIN_VALUE = -(1 << 63)
+
+MAX_VALUE = (1 << 63) - 1
+
+BULK_FILL = 0.9
+
+
+class Node:
+    def __init__(self, page, leaf, keys, children=None, next_leaf=0):
+        self.page = page
+        self.leaf = leaf
+        self.keys = keys
+        self.children = children
+        self.next_leaf = next_leaf
+
+
+# Page-based B+tree of (key, value) int64 pairs in a memory-mapped file.
+# Entries are ordered on the whole pair, so a key may repeat with different
+# values; range scans follow the chain of leaf pages.
+class BPlusTree:
+    def __init__(self, path, page_size=PAGE_SIZE):
+        self.path = Path(path)
+        new = not self.path.is_file() or self.path.stat().st_size == 0
+        self.file = self.path.open('w+b' if new else 'r+b')
+        if new:
+            self.page_size = page_size
+            self.root, self.height, self.page_count, self.free_head, self.entries = 1, 1, 2, 0, 0
+            self.file.truncate(self.page_size * self.page_count)
+            self.map = mmap.mmap(self.file.fileno(), self.page_size * self.page_count)
+            self.write(Node(self.root, True, []))
+            self.write_header()
+        else:
+            header = self.file.read(HEADER.size)
+            magic, self.page_size, self.root, self.height, self.page_count, self.free_head, self.entries = \
+                HEADER.unpack(header)
+            if magic != MAGIC:
+                raise ValueError(str(self.path) + ' is not a TEAL B+tree file')
+            self.map = mmap.mmap(self.file.fileno(), 0)
+
+        self.leaf_capacity = (self.page_size - NODE_HEADER.size) // 16
+        self.internal_capacity = (self.page_size - NODE_HEADER.size - 4) // 20
+        self.children_offset = NODE_HEADER.size
+        self.separators_offset = NODE_HEADER.size + 4 * (self.internal_capacity + 1)
+
+    def __len__(self):
+        return self.entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.write_header()
+        self.map.flush()
+        self.map.close()
+        self.file.close()
+
+    def write_header(self):
+        HEADER.pack_into(self.map, 0, MAGIC, self.page_size, self.root, self.height, self.page_count,
+                         self.free_head, self.entries)
+
+    def read(self, page):
+        offset = page * self.page_size
+        kind, count, next_leaf = NODE_HEADER.unpack_from(self.map, offset)
+        if kind == LEAF:
+            flat = struct.unpack_from('<%dq' % (2 * count), self.map, offset + NODE_HEADER.size)
+            return Node(page, True, list(zip(flat[0::2], flat[1::2])), next_leaf=next_leaf)
+        if kind != INTERNAL:
+            raise ValueError('Page ' + str(page) + ' is not a tree node')
+        children = list(struct.unpack_from('<%dI' % (count + 1), self.map, offset + self.children_offset))
+        flat = struct.unpack_from('<%dq' % (2 * count), self.map, offset + self.separators_offset)
+        return Node(page, False, list(zip(flat[0::2], flat[1::2])), children)
+
+    def write(self, node):
+        offset = node.page * self.page_size
+        flat = [number for key in node.keys for number in key]
+        if node.leaf:
+            NODE_HEADER.pack_into(self.map, offset, LEAF, len(node.keys), node.next_leaf)
+            struct.pack_into('<%dq' % len(flat), self.map, offset + NODE_HEADER.size, *flat)
+        else:
+            NODE_HEADER.pack_into(self.map, offset, INTERNAL, len(node.keys), 0)
+            struct.pack_into('<%dI' % len(node.children), self.map, offset + self.children_offset,
+                             *node.children)
+            struct.pack_into('<%dq' % len(flat), self.map, offset + self.separators_offset, *flat)
+
+    def allocate(self):
+        if self.free_head:
+            page = self.free_head
+            self.free_head = NODE_HEADER.unpack_from(self.map, page * self.page_size)[2]
+            return page
+
+        page = self.page_count
+        self.page_count += 1
+        if self.page_count * self.page_size > len(self.map):
+            # Grow by doubling so a bulk load remaps O(log n) times.
+            size = max(self.page_count, 2 * len(self.map) // self.page_size) * self.page_size
+            self.map.close()
+            self.file.truncate(size)
+            self.map = mmap.mmap(self.file.fileno(), size)
+        return page
+
+    def free(self, page):
+        NODE_HEADER.pack_into(self.map, page * self.page_size, FREE, 0, self.free_head)
+        self.free_head = page
+
+    def min_keys(self, node):
+        return (self.leaf_capacity if node.leaf else self.internal_capacity) // 2
+
+    def find_leaf(self, entry, path=None):
+        node = self.read(self.root)
+        while not node.leaf:
+            index = bisect_right(node.keys, entry)
+            if path is not None:
+                path.append((node, index))
+            node = self.read(node.children[index])
+        return node
+
+    def insert(self, key, value):
+        entry = (key, value)
+        path = []
+        node = self.find_leaf(entry, path)
+        index = bisect_left(node.keys, entry)
+        if index < len(node.keys) and node.keys[index] == entry:
+            return False
+
+        node.keys.insert(index, entry)
+        self.entries += 1
+        split = self.split_leaf(node) if len(node.keys) > self.leaf_capacity else None
+        self.write(node)
+
+        while split is not None and path:
+            separator, right_page = split
+            parent, index = path.pop()
+            parent.keys.insert(index, separator)
+            parent.children.insert(index + 1, right_page)
+            split = self.split_internal(parent) if len(parent.keys) > self.internal_capacity else None
+            self.write(parent)
+
+        if split is not None:
+            separator, right_page = split
+            root = Node(self.allocate(), False, [separator], [self.root, right_page])
+            self.write(root)
+            self.root = root.page
+            self.height += 1
+        self.write_header()
+        return True
+
+    def split_leaf(self, node):
+        middle = len(node.keys) // 2
+        right = Node(self.allocate(), True, node.keys[middle:], next_leaf=node.next_leaf)
+        node.keys = node.keys[:middle]
+        node.next_leaf = right.page
+        self.write(right)
+        return right.keys[0], right.page
+
+    def split_internal(self, node):
+        middle = len(node.keys) // 2
+        separator = node.keys[middle]
+        right = Node(self.allocate(), False, node.keys[middle + 1:], node.children[middle + 1:])
+        node.keys = node.keys[:middle]
+        node.children = node.children[:middle + 1]
+        self.write(right)
+        return separator, right.page
+
+    def delete(self, key, value):
+        entry = (key, value)
+        path = []
+        node = self.find_leaf(entry, path)
+        index = bisect_left(node.keys, entry)
+        if index == len(node.keys) or node.keys[index] != entry:
+            return False
+
+        del node.keys[index]
+        self.entries -= 1
+        self.write(node)
+        while path and len(node.keys) < self.min_keys(node):
+            parent, index = path.pop()
+            self.fill(parent, index, node)
+            node = parent
+
+        root = self.read(self.root)
+        if not root.leaf and not root.keys:
+            self.root = root.children[0]
+            self.height -= 1
+            self.free(root.page)
+        self.write_header()
+        return True
+
+    def fill(self, parent, index, node):
+        left = self.read(parent.children[index - 1]) if index > 0 else None
+        right = self.read(parent.children[index + 1]) if index + 1 < len(parent.children) else None
+        if left is not None and len(left.keys) > self.min_keys(left):
+            self.borrow_from_pred(parent, index, left, node)
+        elif right is not None and len(right.keys) > self.min_keys(right):
+            self.borrow_from_succ(parent, index, node, right)
+        elif left is not None:
+            self.merge(parent, index - 1, left, node)
+        else:
+            self.merge(parent, index, node, right)
+
+    def borrow_from_pred(self, parent, index, left, node):
+        if node.leaf:
+            node.keys.insert(0, left.keys.pop())
+            parent.keys[index - 1] = node.keys[0]
+        else:
+            node.keys.insert(0, parent.keys[index - 1])
+            node.children.insert(0, left.children.pop())
+            parent.keys[index - 1] = left.keys.pop()
+        self.write(left)
+        self.write(node)
+        self.write(parent)
+
+    def borrow_from_succ(self, parent, index, node, right):
+        if node.leaf:
+            node.keys.append(right.keys.pop(0))
+            parent.keys[index] = right.keys[0]
+        else:
+            node.keys.append(parent.keys[index])
+            node.children.append(right.children.pop(0))
+            parent.keys[index] = right.keys.pop(0)
+        self.write(right)
+        self.write(node)
+        self.write(parent)
+
+    def merge(self, parent, index, left, right):
+        if left.leaf:
+            left.keys.extend(right.keys)
+            left.next_leaf = right.next_leaf
+        else:
+            left.keys.append(parent.keys[index])
+            left.keys.extend(right.keys)
+            left.children.extend(right.children)
+        del parent.keys[index]
+        del parent.children[index + 1]
+        self.free(right.page)
+        self.write(left)
+        self.write(parent)
+
+    def range(self, low=None, high=None):
+        start = (MIN_VALUE if low is None else low, MIN_VALUE)
+        end = (MAX_VALUE if high is None else high, MAX_VALUE)
+        node = self.find_leaf(start)
+        index = bisect_left(node.keys, start)
+        while True:
+            keys = node.keys
+            while index < len(keys):
+                if keys[index] > end:
+                    return
+                yield keys[index]
+                index += 1
+            if not node.next_leaf:
+                return
+            node = self.read(node.next_leaf)
+            index = 0
+
+    def search(self, key):
+        return [value for _, value in self.range(key, key)]
+
+    def bulk_load(self, entries, fill=BULK_FILL):
+        if self.entries:
+            raise ValueError('bulk_load needs an empty tree')
+
+        # Leaves are written left to right as the sorted input streams in; only
+        # the (first key, page) of each node is kept to build the levels above.
+        per_leaf = max(2, int(self.leaf_capacity * fill))
+        level = []
+        previous = None
+        batch = []
+        last = None
+        self.free(self.root)
+        for entry in entries:
+            entry = (int(entry[0]), int(entry[1]))
+            if last is not None and entry <= last:
+                raise ValueError('bulk_load input must be sorted and unique, got %r after %r' % (entry, last))
+            last = entry
+            batch.append(entry)
+            self.entries += 1
+            if len(batch) == per_leaf:
+                previous = self.chain_leaf(previous, batch, level)
+                batch = []
+
+        if batch or previous is None:
+            if previous is not None and len(batch) < self.leaf_capacity // 2:
+                # Even out the last two leaves rather than leave a tiny one.
+                both = previous.keys + batch
+                previous.keys, batch = both[:len(both) // 2], both[len(both) // 2:]
+            previous = self.chain_leaf(previous, batch, level)
+        self.write(previous)
+
+        self.height = 1
+        per_node = max(2, int(self.internal_capacity * fill)) + 1
+        while len(level) > 1:
+            groups = -(-len(level) // per_node)
+            size, extra = divmod(len(level), groups)
+            parents = []
+            start = 0
+            for group in range(groups):
+                children = level[start:start + size + (1 if group < extra else 0)]
+                start += len(children)
+                node = Node(self.allocate(), False, [key for key, _ in children[1:]],
+                            [page for _, page in children])
+                self.write(node)
+                parents.append((children[0][0], node.page))
+            level = parents
+            self.height += 1
+        self.root = level[0][1]
+        self.write_header()
+
+    def chain_leaf(self, previous, batch, level):
+        leaf = Node(self.allocate(), True, batch)
+        if previous is not None:
+            previous.next_leaf = leaf.page
+            self.write(previous)
+        level.append((batch[0] if batch else (MIN_VALUE, MIN_VALUE), leaf.page))
+        return leaf
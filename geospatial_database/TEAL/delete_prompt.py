@@ -92,7 +92,7 @@ def delete_county(database):
             delete_land(database)
     elif delete_on == 'n':
         delete_name = input('name to delete: \t')
-        database.delete_item('county', 'name', '= "' + delete_name + '"')
+        database.delete_by_name('county', delete_name)
     elif delete_on == 'p':
         delete_pop = input('population to delete (accepts range using >, <, =): \t')
         database.delete_item('county', 'pop', delete_pop)
@@ -162,7 +162,7 @@ def delete_owner(database):
         database.delete_item('owner', 'status', '= "' + delete_status + '"')
     elif delete_on == 'n':
         delete_name = input('name to delete: \t')
-        database.delete_item('owner', 'name', '= "' + delete_name + '"')
+        database.delete_by_name('owner', delete_name)
     else:
         sys.stdout.write("Did not recognize selection.\t")
         delete_owner(database)
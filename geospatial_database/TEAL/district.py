@@ -0,0 +1,139 @@
+import csv
+import json
+import shutil
+import numpy as np
+from pathlib import Path
+from final_project import util
+
+DISTRICT_STORE_VERSION = 1
+
+MANIFEST_NAME = 'manifest.json'
+
+AGGREGATIONS = ('sum', 'mean', 'count', 'min', 'max')
+
+
+class DistrictStore:
+    def __init__(self, store_dir):
+        self.store_dir = Path(store_dir)
+        with (self.store_dir / MANIFEST_NAME).open('r') as manifest_file:
+            self.manifest = json.load(manifest_file)
+        self.column_names = [column['name'] for column in self.manifest['columns']]
+        self.columns = {}
+
+    @classmethod
+    def open(cls, csv_path, store_dir=None):
+        if store_dir is None:
+            store_dir = csv_path.parent / (csv_path.stem + '_columns')
+        store_dir = Path(store_dir)
+        if not store_is_current(csv_path, store_dir):
+            convert_csv(csv_path, store_dir)
+        return cls(store_dir)
+
+    def __len__(self):
+        return self.manifest['rows']
+
+    def column(self, name):
+        if name not in self.columns:
+            if name not in self.column_names:
+                raise KeyError('No such district column: ' + name)
+            self.columns[name] = np.load(self.store_dir / (name + '.npy'), mmap_mode='r')
+        return self.columns[name]
+
+    def numeric_columns(self):
+        return [column['name'] for column in self.manifest['columns'] if column['dtype'][0] in 'if']
+
+    def county_ids(self, crosswalk_csv, district_column='did'):
+        # district.csv carries no county key, so a did -> county_id crosswalk maps each row to a county.
+        crosswalk = np.loadtxt(crosswalk_csv, delimiter=',', skiprows=1, usecols=(0, 1), dtype=np.int64, ndmin=2)
+        crosswalk = crosswalk[np.argsort(crosswalk[:, 0])]
+        districts = np.asarray(self.column(district_column), dtype=np.int64)
+        positions = np.searchsorted(crosswalk[:, 0], districts).clip(0, len(crosswalk) - 1)
+        found = crosswalk[positions, 0] == districts
+        return np.where(found, crosswalk[positions, 1], -1)
+
+    def aggregate(self, name, group_ids, how='sum', weights=None):
+        if how not in AGGREGATIONS:
+            raise ValueError('Aggregation must be one of ' + ', '.join(AGGREGATIONS))
+        if weights is not None and how not in ('sum', 'mean'):
+            raise ValueError('Weights only apply to sum and mean, not ' + how)
+
+        group_ids = np.asarray(group_ids)
+        values = np.asarray(self.column(name), dtype=np.float64)
+        keep = (group_ids >= 0) & ~np.isnan(values)
+        keys, inverse = np.unique(group_ids[keep], return_inverse=True)
+        values = values[keep]
+
+        if how == 'count':
+            result = np.bincount(inverse, minlength=len(keys)).astype(np.float64)
+        elif how in ('sum', 'mean'):
+            if weights is not None:
+                weights = np.asarray(self.column(weights), dtype=np.float64)[keep]
+                values = values * weights
+            result = np.bincount(inverse, weights=values, minlength=len(keys))
+            if how == 'mean':
+                divisor = (np.bincount(inverse, minlength=len(keys)) if weights is None
+                           else np.bincount(inverse, weights=weights, minlength=len(keys)))
+                result = result / np.where(divisor == 0, np.nan, divisor)
+        else:
+            fill = np.inf if how == 'min' else -np.inf
+            result = np.full(len(keys), fill)
+            (np.minimum if how == 'min' else np.maximum).at(result, inverse, values)
+        return keys, result
+
+
+def store_is_current(csv_path, store_dir):
+    manifest_path = store_dir / MANIFEST_NAME
+    if not manifest_path.is_file():
+        return False
+    with manifest_path.open('r') as manifest_file:
+        manifest = json.load(manifest_file)
+    stat = csv_path.stat()
+    if manifest.get('version') != DISTRICT_STORE_VERSION or manifest.get('size') != stat.st_size:
+        return False
+    return manifest.get('mtime') == stat.st_mtime_ns or manifest.get('sha256') == util.file_sha256(csv_path)
+
+
+def convert_csv(csv_path, store_dir):
+    with csv_path.open('r', encoding='utf-8-sig') as csv_file:
+        read_csv = csv.reader(csv_file, delimiter=',')
+        header = next(read_csv)
+        raw = [[] for _ in header]
+        for row in read_csv:
+            if not row:
+                continue
+            for index in range(len(header)):
+                raw[index].append(row[index] if index < len(row) else '')
+
+    if store_dir.exists():
+        shutil.rmtree(store_dir)
+    store_dir.mkdir(parents=True)
+
+    columns = []
+    for name, values in zip(header, raw):
+        array = typed_column(values)
+        np.save(store_dir / (name + '.npy'), array)
+        columns.append({'name': name, 'dtype': array.dtype.str[1:]})
+
+    stat = csv_path.stat()
+    manifest = {'version': DISTRICT_STORE_VERSION,
+                'source': str(csv_path),
+                'size': stat.st_size,
+                'mtime': stat.st_mtime_ns,
+                'sha256': util.file_sha256(csv_path),
+                'rows': len(raw[0]) if raw else 0,
+                'columns': columns}
+    # The manifest is written last so an interrupted conversion is redone on the next open.
+    with (store_dir / MANIFEST_NAME).open('w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+
+
+def typed_column(values):
+    try:
+        array = np.array([float(value) if value.strip() else np.nan for value in values], dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype=np.str_)
+
+    whole = array[~np.isnan(array)]
+    if len(whole) == len(array) and np.all(whole == np.floor(whole)) and np.all(np.abs(whole) < 2 ** 53):
+        return array.astype(np.int64)
+    return array
@@ -0,0 +1,174 @@
+import csv
+import gzip
+import io
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+EXPORT_BATCH_SIZE = 5000
+
+WRITE_BUFFER_SIZE = 1 << 20
+
+MAX_WORKERS = 8
+
+MANIFEST_NAME = 'manifest.json'
+
+FORMATS = ('csv', 'csv.gz', 'csv.zst', 'npy')
+
+COMPRESSION_LEVELS = {'csv.gz': 6, 'csv.zst': 3}
+
+PARTITION_COLUMNS = ('county_id', 'owner_id')
+
+# Every source reads land as L, so partitions filter on L.county_id / L.owner_id.
+EXPORT_SOURCES = {'land': 'SELECT L.* FROM land L',
+                  'land_details': 'SELECT L.*, '
+                                  'O.name AS owner_name, '
+                                  'O.status AS owner_status, '
+                                  'C.name AS county_name, '
+                                  'C.growth_rate AS county_growth_rate, '
+                                  'C.pop AS county_population '
+                                  'FROM land L '
+                                  'INNER JOIN owner O '
+                                  'ON O.id = L.owner_id '
+                                  'INNER JOIN county C '
+                                  'ON C.id = L.county_id'}
+
+
+def connect_reader(database_file):
+    return sqlite3.connect(Path(database_file).resolve().as_uri() + '?mode=ro', uri=True,
+                           check_same_thread=False)
+
+
+def partition_ranges(conn, partition_by, buckets=None):
+    # One partition per key value, or with buckets, that many contiguous key
+    # ranges so each partition is an index range scan rather than a full scan.
+    keys = [row[0] for row in conn.execute('SELECT DISTINCT ' + partition_by + ' FROM land '
+                                           'WHERE ' + partition_by + ' IS NOT NULL '
+                                           'ORDER BY ' + partition_by)]
+    if buckets is None or buckets >= len(keys):
+        return [(key, key) for key in keys]
+
+    size, extra = divmod(len(keys), buckets)
+    ranges = []
+    start = 0
+    for bucket in range(buckets):
+        end = start + size + (1 if bucket < extra else 0)
+        ranges.append((keys[start], keys[end - 1]))
+        start = end
+    return ranges
+
+
+def open_text(path, file_format, level):
+    if file_format == 'csv':
+        return path.open('w', newline='', buffering=WRITE_BUFFER_SIZE)
+    if file_format == 'csv.gz':
+        return gzip.open(path, 'wt', compresslevel=level, newline='')
+    try:
+        import zstandard
+    except ImportError:
+        raise ValueError('csv.zst export needs the zstandard package') from None
+    writer = zstandard.ZstdCompressor(level=level).stream_writer(path.open('wb'))
+    return io.TextIOWrapper(writer, newline='', write_through=False)
+
+
+def column_array(values):
+    import numpy as np
+
+    if all(type(value) is int for value in values):
+        return np.array(values, dtype=np.int64)
+    if all(value is None or type(value) in (int, float) for value in values):
+        return np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+    return np.array(['' if value is None else str(value) for value in values], dtype=np.str_)
+
+
+def export_partition(database_file, query, params, path, file_format, level, batch_size):
+    start = time.perf_counter()
+    rows = 0
+    conn = connect_reader(database_file)
+    try:
+        cur = conn.execute(query, params)
+        names = [column[0] for column in cur.description]
+        if file_format == 'npy':
+            import numpy as np
+
+            # One .npy file per column, the same layout as the district store.
+            columns = [[] for _ in names]
+            for batch in iter(lambda: cur.fetchmany(batch_size), []):
+                for column, values in zip(columns, zip(*batch)):
+                    column.extend(values)
+                rows += len(batch)
+            path.mkdir(parents=True, exist_ok=True)
+            for name, values in zip(names, columns):
+                np.save(path / (name + '.npy'), column_array(values))
+            size = sum(file.stat().st_size for file in path.iterdir())
+        else:
+            with open_text(path, file_format, level) as output:
+                writer = csv.writer(output)
+                writer.writerow(names)
+                for batch in iter(lambda: cur.fetchmany(batch_size), []):
+                    writer.writerows(batch)
+                    rows += len(batch)
+            size = path.stat().st_size
+    finally:
+        conn.close()
+    return {'rows': rows, 'bytes': size, 'seconds': time.perf_counter() - start, 'columns': names}
+
+
+def export(database_file, source, output_dir, partition_by='county_id', file_format='csv.gz', workers=None,
+           buckets=None, level=None, batch_size=EXPORT_BATCH_SIZE):
+    if str(database_file) == ':memory:':
+        raise ValueError('Export reads on separate connections and needs a database file')
+    if source not in EXPORT_SOURCES:
+        raise ValueError('Export source must be one of ' + ', '.join(EXPORT_SOURCES))
+    if partition_by is not None and partition_by not in PARTITION_COLUMNS:
+        raise ValueError('Partition column must be one of ' + ', '.join(PARTITION_COLUMNS))
+    if file_format not in FORMATS:
+        raise ValueError('Export format must be one of ' + ', '.join(FORMATS))
+
+    start = time.perf_counter()
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    level = COMPRESSION_LEVELS.get(file_format) if level is None else level
+    query = EXPORT_SOURCES[source]
+    # npy partitions are directories of column files.
+    suffix = '' if file_format == 'npy' else '.' + file_format
+
+    if partition_by is None:
+        tasks = [(None, None, query, (), output_dir / (source + suffix))]
+    else:
+        conn = connect_reader(database_file)
+        try:
+            ranges = partition_ranges(conn, partition_by, buckets)
+        finally:
+            conn.close()
+        tasks = []
+        for low, high in ranges:
+            name = source + '_' + partition_by + '_' + (str(low) if low == high else '%s-%s' % (low, high))
+            tasks.append((low, high, query + ' WHERE L.' + partition_by + ' BETWEEN ? AND ?', (low, high),
+                          output_dir / (name + suffix)))
+
+    workers = workers or min(MAX_WORKERS, os.cpu_count() or 1)
+    with ThreadPoolExecutor(workers, thread_name_prefix='teal-export') as executor:
+        results = list(executor.map(lambda task: export_partition(database_file, task[2], task[3], task[4],
+                                                                  file_format, level, batch_size), tasks))
+
+    partitions = [{'low': low, 'high': high, 'path': path.name, 'rows': result['rows'],
+                   'bytes': result['bytes'], 'seconds': round(result['seconds'], 4)}
+                  for (low, high, _, _, path), result in zip(tasks, results)]
+    manifest = {'source': source,
+                'partition_by': partition_by,
+                'format': file_format,
+                'level': level,
+                'columns': results[0]['columns'] if results else [],
+                'rows': sum(partition['rows'] for partition in partitions),
+                'bytes': sum(partition['bytes'] for partition in partitions),
+                'seconds': round(time.perf_counter() - start, 4),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'partitions': partitions}
+    # Written last, so a manifest only exists for a finished export.
+    with (output_dir / MANIFEST_NAME).open('w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    return manifest
@@ -0,0 +1,80 @@
+import re
+from collections import Counter
+
+ADVISOR_MIN_QUERIES = 3
+
+CONDITION_OPERATOR = re.compile(r'^\s*(<=|>=|<>|!=|==|=|<|>|like|in|between|is\s+not|is)',
+                                re.IGNORECASE)
+
+# Operators a b-tree index can serve; IS NOT and LIKE fall back to a scan anyway.
+INDEXABLE_OPERATORS = {'=', '==', '<', '>', '<=', '>=', 'in', 'between', 'is'}
+
+
+def condition_operator(condition):
+    match = CONDITION_OPERATOR.match(condition or '')
+    if match is None:
+        return None
+    return ' '.join(match.group(1).lower().split())
+
+
+class IndexAdvisor:
+    def __init__(self, min_queries=ADVISOR_MIN_QUERIES):
+        self.min_queries = min_queries
+        self.predicates = Counter()
+
+    def record(self, table, column, condition):
+        operator = condition_operator(condition)
+        if operator is None:
+            return
+        self.predicates[(table.strip().lower(), column.strip().lower(), operator)] += 1
+
+    def column_counts(self):
+        counts = Counter()
+        for (table, column, operator), count in self.predicates.items():
+            if operator in INDEXABLE_OPERATORS:
+                counts[(table, column)] += count
+        return counts
+
+    def propose(self, cur):
+        proposals = []
+        for (table, column), count in self.column_counts().most_common():
+            if count < self.min_queries:
+                break
+            if column not in table_columns(cur, table) or column in leading_index_columns(cur, table):
+                continue
+            proposals.append(('advised_' + table + '_' + column, table, column, count))
+        return proposals
+
+    def apply(self, cur):
+        proposals = self.propose(cur)
+        for index_name, table, column, _ in proposals:
+            cur.execute('CREATE INDEX IF NOT EXISTS ' + index_name + ' ON ' + table + ' (' + column + ')')
+        return proposals
+
+    def reset(self):
+        self.predicates.clear()
+
+
+def table_columns(cur, table):
+    cur.execute('PRAGMA table_info(' + quote_identifier(table) + ')')
+    return {row[1].lower() for row in cur.fetchall()}
+
+
+def leading_index_columns(cur, table):
+    columns = set()
+    cur.execute('PRAGMA table_info(' + quote_identifier(table) + ')')
+    for row in cur.fetchall():
+        if row[5] == 1 and row[2].upper() == 'INTEGER':
+            columns.add(row[1].lower())
+
+    cur.execute('PRAGMA index_list(' + quote_identifier(table) + ')')
+    for index in cur.fetchall():
+        cur.execute('PRAGMA index_info(' + quote_identifier(index[1]) + ')')
+        index_columns = cur.fetchall()
+        if index_columns:
+            columns.add(min(index_columns)[2].lower())
+    return columns
+
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
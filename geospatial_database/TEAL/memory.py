@@ -0,0 +1,100 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from final_project.TEAL import queries, predicate
+
+# Pages copied per backup step; between steps the snapshot lets go of the
+# database so queries on other threads are only held up for one step.
+SNAPSHOT_PAGES = 1024
+
+SNAPSHOT_SLEEP_SECONDS = 0.001
+
+
+class MemoryDatabase(queries.Database):
+    # Serves everything from an in-memory copy of database_file. A persistent
+    # session starts from the file through the backup API; snapshot() copies
+    # the memory database back on demand, every snapshot_seconds, and on close.
+    def __init__(self, database_file, persistent=False, snapshot_seconds=None, pages=SNAPSHOT_PAGES):
+        self.pages = pages
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_version = None
+        self.stop_snapshots = threading.Event()
+        self.snapshot_thread = None
+        super().__init__(database_file, persistent)
+
+        if snapshot_seconds:
+            self.snapshot_thread = threading.Thread(target=self.snapshot_every, args=(snapshot_seconds,),
+                                                    name='teal-snapshot', daemon=True)
+            self.snapshot_thread.start()
+
+    def connect(self):
+        conn = sqlite3.connect(':memory:', check_same_thread=False, cached_statements=predicate.STATEMENT_CACHE_SIZE)
+        if self.persistent and Path(self.db_file).is_file():
+            start = time.perf_counter()
+            disk = sqlite3.connect(self.db_file)
+            try:
+                disk.backup(conn, pages=self.pages)
+            finally:
+                disk.close()
+            self.snapshot_version = 0
+            sys.stdout.write('Restored %s into memory in %.3fs\n' % (Path(self.db_file).name,
+                                                                   time.perf_counter() - start))
+        return conn
+
+    def snapshot(self):
+        if self.transaction_depth:
+            raise ValueError('Cannot snapshot inside a transaction')
+        self.commit()
+        return self.write_snapshot()
+
+    def write_snapshot(self):
+        # Copies into a sibling file that replaces database_file only once
+        # complete, so a crash mid-snapshot leaves the previous one intact.
+        with self.snapshot_lock:
+            version = sum(self.generations.values())
+            if version == self.snapshot_version:
+                return False
+
+            start = time.perf_counter()
+            database_file = Path(self.db_file)
+            partial = database_file.with_name(database_file.name + '.snapshot')
+            target = sqlite3.connect(partial)
+            try:
+                self.conn.backup(target, pages=self.pages, sleep=SNAPSHOT_SLEEP_SECONDS)
+            finally:
+                target.close()
+            # A journal left by an earlier WAL-mode session belongs to the old file.
+            for suffix in ('-wal', '-shm'):
+                stale = database_file.with_name(database_file.name + suffix)
+                if stale.is_file():
+                    stale.unlink()
+            os.replace(partial, database_file)
+            self.snapshot_version = version
+            sys.stdout.write('Snapshot of %s written in %.3fs\n' % (database_file.name, time.perf_counter() - start))
+            return True
+
+    def snapshot_every(self, seconds):
+        while not self.stop_snapshots.wait(seconds):
+            # Writes still waiting on a group commit are picked up next time.
+            if self.conn.in_transaction:
+                continue
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                print('Encountered error: ', e, 'while writing a snapshot')
+
+    def export(self, *args, **kwargs):
+        # Export reads the database file on separate connections.
+        self.materialize(*queries.EXPORT_TABLES)
+        self.snapshot()
+        return super().export(*args, **kwargs)
+
+    def close(self):
+        self.stop_snapshots.set()
+        if self.snapshot_thread is not None:
+            self.snapshot_thread.join()
+        self.snapshot()
+        super().close()
@@ -1,49 +1,83 @@
 import sys
 from final_project import util
-from final_project.TEAL import user_prompt
+from final_project.TEAL import user_prompt, predicate
 
 
 def initiate_modify(database):
-    table = input('Modify: \n\t'
-                  'Table name: \t').lower()
-    if table == 'q':
-        util.exit_TEAL(database)
-    elif table == 'land':
-        modify_land(database)
-    elif table == 'county':
-        modify_county(database)
-    elif table == 'improvement':
-        modify_improvement(database)
-    elif table == 'owner':
-        modify_owner(database)
-    elif table == '':
-        sys.stdout.write('Table must be specified for modify\t')
-        initiate_modify(database)
-    else:
-        sys.stdout.write('Did not recognize table name. Please specify table in database: \n\t'
-                         'land\n\t'
-                         'county\n\t'
-                         'improvement\n\t'
-                         'owner\n\t')
+    try:
+        table = input('Modify: \n\t'
+                      'Table name: \t').lower()
+        if table == 'q':
+            util.exit_TEAL(database)
+        elif table == 'land':
+            modify_land(database)
+        elif table == 'county':
+            modify_county(database)
+        elif table == 'improvement':
+            modify_improvement(database)
+        elif table == 'owner':
+            modify_owner(database)
+        elif table == '':
+            sys.stdout.write('Table must be specified for modify\t')
+            initiate_modify(database)
+        else:
+            sys.stdout.write('Did not recognize table name. Please specify table in database: \n\t'
+                             'land\n\t'
+                             'county\n\t'
+                             'improvement\n\t'
+                             'owner\n\t')
+            initiate_modify(database)
+    except Exception as e:
+        print("Encountered error: ", e, "while attempting modify.")
         initiate_modify(database)
 
     repeat(database)
 
-    
+
 def modify_land(database):
-    pass
+    modify_on = input("Modifying land. Specify modification: \n\t"
+                      "Apply an improvement to low rated parcels: i\n\t"
+                      "Reassign an owner's parcels to another owner: o\n\t"
+                      "Set owner_id, county_id, rating or area: s\n\t").lower()
+
+    if modify_on == 'q':
+        util.exit_TEAL(database)
+    elif modify_on == 'i':
+        improvement_id = int(input('improvement id to apply: \t'))
+        max_rating = int(input('apply to parcels rated at most: \t'))
+        county_id = input('only in county id (blank for all counties): \t')
+        database.apply_improvement(improvement_id, max_rating, int(county_id) if county_id.strip() else None)
+    elif modify_on == 'o':
+        from_owner_id = int(input('owner id to take parcels from: \t'))
+        to_owner_id = int(input('owner id to give parcels to: \t'))
+        database.reassign_owner(from_owner_id, to_owner_id)
+    elif modify_on == 's':
+        set_column(database, 'land')
+    else:
+        sys.stdout.write("Did not recognize selection.\t")
+        modify_land(database)
 
 
 def modify_county(database):
-    pass
+    set_column(database, 'county')
 
 
 def modify_owner(database):
-    pass
+    set_column(database, 'owner')
 
 
 def modify_improvement(database):
-    pass
+    set_column(database, 'improvement')
+
+
+def set_column(database, table):
+    column = input('Modifying ' + table + '. Column to set: \t').strip()
+    if column.lower() == 'q':
+        util.exit_TEAL(database)
+    value = predicate.parse_literal(input('new value for ' + column + ': \t'))
+    where_column = input('modify rows where column: \t').strip()
+    condition = input('condition on ' + where_column + ' (accepts range using <, >, =): \t')
+    database.modify_item(table, where_column, condition, {column: value})
 
 
 def repeat(database):
@@ -0,0 +1,91 @@
+import csv
+import io
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+CHUNK_BYTES = 16 << 20
+
+MAX_WORKERS = 8
+
+
+def chunk_ranges(csv_path, chunk_bytes=CHUNK_BYTES):
+    # Byte ranges after the header line, each ending just after a newline so
+    # no row is split between two chunks.
+    size = csv_path.stat().st_size
+    ranges = []
+    with csv_path.open('rb') as csv_file:
+        csv_file.readline()
+        start = csv_file.tell()
+        while start < size:
+            csv_file.seek(min(start + chunk_bytes, size))
+            if csv_file.tell() < size:
+                csv_file.readline()
+            end = csv_file.tell()
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def read_range(csv_path, start, end):
+    with open(csv_path, 'rb') as csv_file:
+        csv_file.seek(start)
+        return csv_file.read(end - start).decode('utf-8')
+
+
+def parse_numeric(text, column_count):
+    width = len(text[:text.find('\n')].split(',')) if '\n' in text else len(text.split(','))
+    try:
+        table = np.loadtxt(io.StringIO(text), delimiter=',', dtype=np.int64, usecols=range(column_count),
+                           ndmin=2)
+        geometry = None
+        if width >= 7:
+            geometry = np.loadtxt(io.StringIO(text), delimiter=',', dtype=np.float64,
+                                  usecols=range(5, 9 if width >= 9 else 7), ndmin=2)
+    except ValueError:
+        return None
+    return table, geometry
+
+
+def parse_chunk(csv_path, start, end, column_count):
+    # Runs in a worker process. Returns the rows as lists ready for
+    # executemany, or None when NumPy cannot parse the chunk (blank or
+    # non-integer fields), in which case the writer loads it as text.
+    parsed = parse_numeric(read_range(csv_path, start, end), column_count)
+    if parsed is None:
+        return None
+    table, geometry = parsed
+    rows = table.tolist()
+    bounds = []
+    if geometry is not None:
+        if geometry.shape[1] == 2:
+            geometry = geometry[:, [0, 0, 1, 1]]
+        bounds = [[row[0]] + bound for row, bound in zip(rows, geometry.tolist())]
+    return rows, bounds
+
+
+def text_rows(csv_path, start, end, column_count):
+    rows = [row for row in csv.reader(io.StringIO(read_range(csv_path, start, end))) if row]
+    return [row[:column_count] for row in rows], rows
+
+
+def iter_batches(csv_path, column_count, land_bounds, workers=None, chunk_bytes=CHUNK_BYTES):
+    # Chunks are parsed in a process pool and handed back in file order to
+    # the caller, the single writer. At most two chunks per worker are in
+    # flight so a slow writer does not pile parsed rows up in memory.
+    workers = workers or min(MAX_WORKERS, os.cpu_count() or 1)
+    ranges = deque(chunk_ranges(csv_path, chunk_bytes))
+    pending = deque()
+    with ProcessPoolExecutor(workers) as executor:
+        while ranges or pending:
+            while ranges and len(pending) < 2 * workers:
+                start, end = ranges.popleft()
+                pending.append(((start, end), executor.submit(parse_chunk, str(csv_path), start, end,
+                                                                column_count)))
+            (start, end), future = pending.popleft()
+            parsed = future.result()
+            if parsed is None:
+                rows, raw = text_rows(csv_path, start, end, column_count)
+                parsed = rows, list(land_bounds(raw))
+            yield parsed
@@ -0,0 +1,242 @@
+import numpy as np
+
+PLAN_METHODS = ('greedy', 'knapsack')
+
+# rating counts every rating point gained the same; area weights each by the parcel's area.
+PLAN_OBJECTIVES = ('rating', 'area')
+
+PLAN_COLUMNS = ('land_id', 'county_id', 'improvement_id', 'improvement_type', 'rating', 'new_rating', 'area',
+                'cost', 'gain')
+
+
+class Plan:
+    # Parcels are in rank order; improvement holds an index into the
+    # improvement arrays the plan was made from.
+    def __init__(self, parcels, improvement, cost, gain, budget):
+        self.parcels = parcels
+        self.improvement = improvement
+        self.cost = cost
+        self.gain = gain
+        self.budget = budget
+
+    def __len__(self):
+        return len(self.parcels)
+
+    def total_cost(self):
+        return float(self.cost.sum())
+
+    def total_gain(self):
+        return float(self.gain.sum())
+
+    def rows(self, land, improvements, max_rating):
+        ratings = land['rating'][self.parcels]
+        new_ratings = np.minimum(ratings + improvements['level'][self.improvement], max_rating)
+        return list(zip(land['id'][self.parcels].tolist(),
+                        land['county_id'][self.parcels].tolist(),
+                        improvements['id'][self.improvement].tolist(),
+                        [improvements['type'][index] for index in self.improvement.tolist()],
+                        ratings.tolist(),
+                        new_ratings.tolist(),
+                        land['area'][self.parcels].tolist(),
+                        self.cost.tolist(),
+                        self.gain.tolist()))
+
+
+def empty_plan(budget):
+    empty = np.zeros(0, dtype=np.int64)
+    return Plan(empty, empty, np.zeros(0), np.zeros(0), budget)
+
+
+def rating_gains(ratings, levels, max_rating):
+    # gains[r, j] is how far improvement j raises a parcel rated ratings[r],
+    # capped at max_rating as in Database.apply_improvement.
+    ratings = np.asarray(ratings)[:, None]
+    return np.maximum(np.minimum(ratings + levels[None, :], max_rating) - ratings, 0)
+
+
+def upper_hull(costs, gains):
+    # Improvements on the upper concave hull of (cost, gain) through the
+    # origin, cheapest first. Each step along it buys gain at a lower rate
+    # than the one before; improvements below it are never worth choosing.
+    order = np.lexsort((-gains, costs))
+    hull = []
+    for index in order.tolist():
+        if gains[index] <= 0 or (hull and gains[index] <= gains[hull[-1]]):
+            continue
+        while hull:
+            last_cost, last_gain = (costs[hull[-2]], gains[hull[-2]]) if len(hull) > 1 else (0.0, 0.0)
+            # The last point goes when the new one is on or above the line to it.
+            if ((gains[hull[-1]] - last_gain) * (costs[index] - last_cost) <=
+                    (gains[index] - last_gain) * (costs[hull[-1]] - last_cost)):
+                hull.pop()
+            else:
+                break
+        hull.append(index)
+    return hull
+
+
+def parcel_weights(land, objective):
+    if objective == 'area':
+        return land['area'].astype(np.float64)
+    return np.ones(len(land['id']))
+
+
+def slopes(value, cost):
+    # Free gains come first.
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(cost > 0, value / np.where(cost > 0, cost, 1), np.inf)
+
+
+def plan_greedy(land, improvements, budget, objective, max_rating):
+    # Each parcel gets the improvement with the best gain per unit cost; the
+    # parcels are then taken in that order while they fit the budget.
+    # Costs scale with area, so the best improvement depends only on rating.
+    ratings, inverse = np.unique(land['rating'], return_inverse=True)
+    gains = rating_gains(ratings, improvements['level'], max_rating)
+    unit_costs = improvements['cost']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = np.where(unit_costs[None, :] > 0, gains / np.where(unit_costs > 0, unit_costs, 1)[None, :],
+                          np.where(gains > 0, np.inf, 0))
+    # The larger gain breaks ties between equally efficient improvements.
+    best = np.lexsort((-gains, -ratios), axis=1)[:, 0]
+    choice = best[inverse]
+
+    weights = parcel_weights(land, objective)
+    cost = unit_costs[choice] * land['area']
+    value = gains[inverse, choice] * weights
+    order = np.lexsort((-value, -slopes(value, cost)))
+    order = order[value[order] > 0]
+
+    cumulative = np.cumsum(cost[order])
+    taken = np.searchsorted(cumulative, budget, side='right')
+    remaining = budget - (cumulative[taken - 1] if taken else 0.0)
+    selected = [order[:taken]]
+    # Past the first parcel that does not fit, smaller ones may still.
+    rest = order[taken:]
+    rest = rest[cost[rest] <= remaining]
+    extra = []
+    for index, parcel_cost in zip(rest.tolist(), cost[rest].tolist()):
+        if parcel_cost <= remaining:
+            extra.append(index)
+            remaining -= parcel_cost
+    selected = np.concatenate(selected + [np.array(extra, dtype=np.int64)])
+    return Plan(selected, choice[selected], cost[selected], value[selected], budget)
+
+
+def plan_knapsack(land, improvements, budget, objective, max_rating):
+    # Multiple-choice knapsack, one improvement per parcel, solved through
+    # its LP relaxation: every parcel's hull steps are pooled and taken by
+    # gain per unit cost until the budget runs out. The better of that and
+    # the best single parcel is at least half the optimum and, unlike greedy,
+    # can buy a parcel a bigger improvement once the cheap gains elsewhere
+    # are used up.
+    ratings, inverse = np.unique(land['rating'], return_inverse=True)
+    gains = rating_gains(ratings, improvements['level'], max_rating)
+    unit_costs = improvements['cost']
+    weights = parcel_weights(land, objective)
+
+    parcels, steps, choices, costs, values = [], [], [], [], []
+    for rating_index in range(len(ratings)):
+        members = np.flatnonzero(inverse == rating_index)
+        previous_cost, previous_gain = 0.0, 0.0
+        for step, index in enumerate(upper_hull(unit_costs, gains[rating_index].astype(np.float64))):
+            parcels.append(members)
+            steps.append(np.full(len(members), step))
+            choices.append(np.full(len(members), index))
+            costs.append((unit_costs[index] - previous_cost) * land['area'][members])
+            values.append((gains[rating_index, index] - previous_gain) * weights[members])
+            previous_cost, previous_gain = unit_costs[index], gains[rating_index, index]
+    if not parcels:
+        return empty_plan(budget)
+
+    parcels, steps, choices = np.concatenate(parcels), np.concatenate(steps), np.concatenate(choices)
+    costs, values = np.concatenate(costs), np.concatenate(values)
+    # A parcel's steps have falling slopes, so sorting by slope keeps them in
+    # order and any prefix takes each parcel's steps from the first.
+    order = np.lexsort((steps, -slopes(values, costs)))
+    cumulative = np.cumsum(costs[order])
+    count = np.searchsorted(cumulative, budget, side='right')
+    taken = order[:count]
+
+    # A parcel ends on its last step taken; it ranks by its first.
+    final = np.full(len(land['id']), -1)
+    np.maximum.at(final, parcels[taken], steps[taken])
+    # Past the step that did not fit, smaller ones may still, as long as
+    # each carries on from its parcel's last step.
+    remaining = budget - (cumulative[count - 1] if count else 0.0)
+    rest = order[count:]
+    rest = rest[costs[rest] <= remaining]
+    extra = []
+    for index, parcel, step, step_cost in zip(rest.tolist(), parcels[rest].tolist(), steps[rest].tolist(),
+                                              costs[rest].tolist()):
+        if step_cost <= remaining and step == final[parcel] + 1:
+            final[parcel] = step
+            remaining -= step_cost
+            extra.append(index)
+    taken = np.concatenate([taken, np.array(extra, dtype=np.int64)])
+    rank = np.full(len(land['id']), len(taken))
+    np.minimum.at(rank, parcels[taken], np.arange(len(taken)))
+    selected = np.flatnonzero(final >= 0)
+    selected = selected[np.argsort(rank[selected], kind='stable')]
+
+    last = taken[steps[taken] == final[parcels[taken]]]
+    choice = np.full(len(land['id']), -1)
+    choice[parcels[last]] = choices[last]
+    chosen = choice[selected]
+    cost = unit_costs[chosen] * land['area'][selected]
+    value = gains[inverse[selected], chosen] * weights[selected]
+    # The LP prefix alone can be arbitrarily far from the optimum when one
+    # large parcel outweighs the rest, so the best single parcel and the
+    # greedy plan stand against it.
+    plans = [Plan(selected, chosen, cost, value, budget),
+             best_single(land, improvements, budget, objective, max_rating),
+             plan_greedy(land, improvements, budget, objective, max_rating)]
+    return max(plans, key=Plan.total_gain)
+
+
+def best_single(land, improvements, budget, objective, max_rating):
+    ratings, inverse = np.unique(land['rating'], return_inverse=True)
+    gains = rating_gains(ratings, improvements['level'], max_rating)
+    weights = parcel_weights(land, objective)
+    best, best_value = None, 0.0
+    for index, unit_cost in enumerate(improvements['cost'].tolist()):
+        cost = unit_cost * land['area']
+        value = np.where(cost <= budget, gains[inverse, index] * weights, 0)
+        parcel = int(np.argmax(value))
+        if value[parcel] > best_value:
+            best, best_value = (parcel, index, float(cost[parcel])), float(value[parcel])
+    if best is None:
+        return empty_plan(budget)
+    parcel, index, cost = best
+    return Plan(np.array([parcel]), np.array([index]), np.array([cost]), np.array([best_value]), budget)
+
+
+def land_arrays(rows):
+    table = np.array(rows, dtype=np.int64).reshape(-1, 4)
+    # Ties are broken by position, so parcels are put in id order whichever
+    # shards they were read from.
+    table = table[np.argsort(table[:, 0], kind='stable')]
+    return {'id': table[:, 0], 'county_id': table[:, 1], 'rating': table[:, 2], 'area': table[:, 3]}
+
+
+def improvement_arrays(rows):
+    return {'id': np.array([row[0] for row in rows], dtype=np.int64),
+            'type': [row[1] for row in rows],
+            'cost': np.array([row[2] for row in rows], dtype=np.float64),
+            'level': np.array([row[3] for row in rows], dtype=np.int64)}
+
+
+PLANNERS = {'greedy': plan_greedy,
+            'knapsack': plan_knapsack}
+
+
+def plan(land, improvements, budget, method='knapsack', objective='rating', max_rating=8):
+    if method not in PLAN_METHODS:
+        raise ValueError('Plan method must be one of ' + ', '.join(PLAN_METHODS))
+    if objective not in PLAN_OBJECTIVES:
+        raise ValueError('Plan objective must be one of ' + ', '.join(PLAN_OBJECTIVES))
+    if budget < 0:
+        raise ValueError('Budget cannot be negative')
+    if len(land['id']) == 0 or len(improvements['id']) == 0:
+        return empty_plan(float(budget))
+    return PLANNERS[method](land, improvements, float(budget), objective, max_rating)
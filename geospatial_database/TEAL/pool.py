@@ -0,0 +1,194 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from final_project.TEAL import queries, predicate
+
+DEFAULT_READERS = 4
+
+BUSY_TIMEOUT_SECONDS = 5.0
+
+READ_METHODS = ('get_land_by_county', 'get_land_by_area', 'get_land_by_owner', 'get_land_by_quality_rating',
+                'view_land_details', 'get_average_rating_county', 'get_area_by_owner', 'get_owners_in_county',
+                'get_critical_land_count_by_county', 'get_land_by_status', 'generic_query', 'select',
+                'get_page', 'get_land_in_box', 'get_land_at_point', 'get_nearest_land', 'search_names',
+                'plan_improvements')
+
+WRITE_METHODS = ('insert_table', 'delete_table', 'delete_item', 'delete_where', 'delete_by_name', 'update_where',
+                 'modify_item', 'apply_improvement', 'reassign_owner', 'load_table', 'bulk_load', 'insert_into_land',
+                 'insert_land_geometry', 'insert_into_county', 'insert_into_improvement', 'insert_into_owner',
+                 'create_advised_indexes', 'get_district_stats_by_county', 'get_land_cube')
+
+
+class PooledDatabase(queries.Database):
+    # journal_mode stays WAL during bulk loads; leaving WAL needs every reader closed.
+    bulk_load_pragmas = {name: value for name, value in queries.BULK_LOAD_PRAGMAS.items()
+                         if name != 'journal_mode'}
+
+    def __init__(self, database_file, persistent=False, readers=DEFAULT_READERS, timeout=BUSY_TIMEOUT_SECONDS):
+        if str(database_file) == ':memory:':
+            raise ValueError('A pooled database needs a database file that readers can share')
+        self.local = threading.local()
+        self.write_lock = threading.RLock()
+        self.timeout = timeout
+        self.stop_flushing = threading.Event()
+        self.flush_thread = None
+        super().__init__(database_file, persistent)
+
+        self.readers = queue.Queue(maxsize=readers)
+        for _ in range(readers):
+            self.readers.put(self.connect_reader())
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_file, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=predicate.STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    def connect_reader(self):
+        conn = sqlite3.connect(Path(self.db_file).resolve().as_uri() + '?mode=ro', uri=True,
+                               timeout=self.timeout, check_same_thread=False,
+                               cached_statements=predicate.STATEMENT_CACHE_SIZE)
+        conn.execute('PRAGMA query_only = ON')
+        return conn
+
+    # conn and cur resolve per thread: a reader checked out by this thread,
+    # otherwise this thread's own cursor on the writer connection.
+    @property
+    def conn(self):
+        return getattr(self.local, 'conn', None) or self.writer
+
+    @conn.setter
+    def conn(self, conn):
+        self.writer = conn
+
+    @property
+    def cur(self):
+        cur = getattr(self.local, 'cur', None)
+        if cur is None:
+            cur = self.local.writer_cur = getattr(self.local, 'writer_cur', None) or self.cursor(self.writer)
+        return cur
+
+    @cur.setter
+    def cur(self, cur):
+        self.local.writer_cur = cur
+
+    @contextmanager
+    def reading(self):
+        if getattr(self.local, 'conn', None) is not None:
+            yield self.local.cur
+            return
+
+        conn = self.readers.get(timeout=self.timeout)
+        self.local.conn = conn
+        self.local.cur = self.cursor(conn)
+        try:
+            yield self.local.cur
+        finally:
+            self.local.cur.close()
+            self.local.conn = None
+            self.local.cur = None
+            self.readers.put(conn)
+
+    @contextmanager
+    def writing(self):
+        with self.write_lock:
+            bound = getattr(self.local, 'conn', None), getattr(self.local, 'cur', None)
+            self.local.conn = None
+            self.local.cur = None
+            try:
+                yield self.cur
+                if self.writer.in_transaction and self.group_commit_ops is None and not self.transaction_depth:
+                    self.writer.commit()
+            except Exception:
+                # SQLite has already undone the failed statement. Writes that
+                # group commit or an open transaction() is holding stay
+                # pending, as they do on a plain Database.
+                if self.writer.in_transaction and self.group_commit_ops is None and not self.transaction_depth:
+                    self.writer.rollback()
+                raise
+            finally:
+                self.local.conn, self.local.cur = bound
+
+    @contextmanager
+    def transaction(self):
+        with self.writing():
+            with super().transaction() as cur:
+                yield cur
+
+    def enable_group_commit(self, max_ops=queries.GROUP_COMMIT_OPS, max_ms=queries.GROUP_COMMIT_MS):
+        super().enable_group_commit(max_ops, max_ms)
+        # Readers never flush, so the last write of a burst would otherwise
+        # wait for the next write, holding the WAL write lock and hidden
+        # from the readers.
+        if self.flush_thread is None:
+            self.flush_thread = threading.Thread(target=self.flush_every, name='teal-flush', daemon=True)
+            self.flush_thread.start()
+
+    def flush_every(self):
+        while not self.stop_flushing.wait((self.group_commit_ms or queries.GROUP_COMMIT_MS) / 1000):
+            self.flush()
+
+    def flush(self):
+        if self.pending_writes:
+            with self.writing():
+                super().flush()
+
+    def materialize(self, *table_names):
+        # A read can be the first to touch a table; the load runs on the
+        # writer and is committed before the reader's statement starts.
+        if any(table_name in self.sources for table_name in table_names):
+            with self.writing():
+                super().materialize(*table_names)
+
+    # Rows of a finished or cached read are kept per thread until written out.
+    @property
+    def result_rows(self):
+        return getattr(self.local, 'rows', None)
+
+    @result_rows.setter
+    def result_rows(self, rows):
+        self.local.rows = rows
+
+    def close(self):
+        self.stop_flushing.set()
+        if self.flush_thread is not None:
+            self.flush_thread.join()
+        while not self.readers.empty():
+            self.readers.get_nowait().close()
+        with self.write_lock:
+            super().close()
+
+
+def pooled_read(method):
+    # The reader goes back to the pool when the call returns, so the rows are
+    # returned and also kept for this thread's next write_result / write_csv.
+    def read(self, *args, **kwargs):
+        if getattr(self.local, 'conn', None) is not None:
+            return method(self, *args, **kwargs)
+        with self.reading() as cur:
+            result = method(self, *args, **kwargs)
+            if result is None:
+                result = cur.fetchall() if cur.description is not None else []
+            if isinstance(result, list):
+                self.result_rows = result
+            return result
+    read.__name__ = method.__name__
+    return read
+
+
+def pooled_write(method):
+    def write(self, *args, **kwargs):
+        with self.writing():
+            return method(self, *args, **kwargs)
+    write.__name__ = method.__name__
+    return write
+
+
+for name in READ_METHODS:
+    setattr(PooledDatabase, name, pooled_read(getattr(queries.Database, name)))
+
+for name in WRITE_METHODS:
+    setattr(PooledDatabase, name, pooled_write(getattr(queries.Database, name)))
@@ -0,0 +1,226 @@
+import re
+import threading
+from collections import OrderedDict
+
+STATEMENT_CACHE_SIZE = 256
+
+COMPARISON_OPERATORS = ('<=', '>=', '<>', '!=', '==', '=', '<', '>')
+
+TERM = re.compile(r'\s*(?:between\s+(?P<low>"[^"]*"|\'[^\']*\'|\S+)\s+and\s+(?P<high>"[^"]*"|\'[^\']*\'|\S+)'
+                  r'|in\s*\((?P<values>[^)]*)\)'
+                  r'|like\s+(?P<pattern>"[^"]*"|\'[^\']*\'|\S+)'
+                  r'|is\s+(?P<negated>not\s+)?null\b'
+                  r'|(?P<op><=|>=|<>|!=|==|=|<|>)\s*'
+                  r'(?P<value>"[^"]*"|\'[^\']*\'|.+?(?=\s+(?:and|or)\s|\s*$)))\s*',
+                  re.IGNORECASE)
+
+CONNECTOR = re.compile(r'(and|or)\s+', re.IGNORECASE)
+
+
+class Comparison:
+    def __init__(self, column, operator, value):
+        if operator not in COMPARISON_OPERATORS:
+            raise ValueError('Unsupported comparison operator ' + operator)
+        self.column = column
+        self.operator = operator
+        self.value = value
+
+    def shape(self):
+        return 'cmp', self.column, self.operator
+
+    def sql(self):
+        return self.column + ' ' + self.operator + ' ?'
+
+    def params(self):
+        return [self.value]
+
+    def terms(self):
+        yield self.column, self.operator
+
+
+class Between:
+    def __init__(self, column, low, high):
+        self.column = column
+        self.low = low
+        self.high = high
+
+    def shape(self):
+        return 'between', self.column
+
+    def sql(self):
+        return self.column + ' BETWEEN ? AND ?'
+
+    def params(self):
+        return [self.low, self.high]
+
+    def terms(self):
+        yield self.column, 'between'
+
+
+class In:
+    def __init__(self, column, values):
+        if not values:
+            raise ValueError('IN list for ' + column + ' is empty')
+        self.column = column
+        self.values = list(values)
+
+    def width(self):
+        # Lists are padded to the next power of two so IN lists of similar
+        # length share one statement shape.
+        width = 1
+        while width < len(self.values):
+            width *= 2
+        return width
+
+    def shape(self):
+        return 'in', self.column, self.width()
+
+    def sql(self):
+        return self.column + ' IN (' + ', '.join('?' * self.width()) + ')'
+
+    def params(self):
+        return self.values + [self.values[-1]] * (self.width() - len(self.values))
+
+    def terms(self):
+        yield self.column, 'in'
+
+
+class Like:
+    def __init__(self, column, pattern):
+        self.column = column
+        self.pattern = pattern
+
+    def shape(self):
+        return 'like', self.column
+
+    def sql(self):
+        return self.column + ' LIKE ?'
+
+    def params(self):
+        return [self.pattern]
+
+    def terms(self):
+        yield self.column, 'like'
+
+
+class IsNull:
+    def __init__(self, column, negated=False):
+        self.column = column
+        self.negated = negated
+
+    def shape(self):
+        return 'null', self.column, self.negated
+
+    def sql(self):
+        return self.column + (' IS NOT NULL' if self.negated else ' IS NULL')
+
+    def params(self):
+        return []
+
+    def terms(self):
+        yield self.column, 'is not' if self.negated else 'is'
+
+
+class And:
+    joiner = ' AND '
+
+    def __init__(self, *predicates):
+        self.predicates = predicates
+
+    def shape(self):
+        return self.joiner.strip(), tuple(predicate.shape() for predicate in self.predicates)
+
+    def sql(self):
+        return '(' + self.joiner.join(predicate.sql() for predicate in self.predicates) + ')'
+
+    def params(self):
+        return [value for predicate in self.predicates for value in predicate.params()]
+
+    def terms(self):
+        for predicate in self.predicates:
+            yield from predicate.terms()
+
+
+class Or(And):
+    joiner = ' OR '
+
+
+class StatementCache:
+    def __init__(self, max_size=STATEMENT_CACHE_SIZE):
+        self.max_size = max_size
+        self.statements = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        with self.lock:
+            statement = self.statements.get(key)
+            if statement is not None:
+                self.hits += 1
+                self.statements.move_to_end(key)
+                return statement
+            self.misses += 1
+
+        statement = build()
+        with self.lock:
+            self.statements[key] = statement
+            if len(self.statements) > self.max_size:
+                self.statements.popitem(last=False)
+        return statement
+
+    def clear(self):
+        self.statements.clear()
+
+
+def parse_literal(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in '"\'':
+        return text[1:-1]
+    for convert in (int, float):
+        try:
+            return convert(text)
+        except ValueError:
+            pass
+    return text
+
+
+# Turns a typed condition such as '>= 3 and < 8', 'between 1 and 4',
+# 'in (1, 2)', "like 'A%'" or 'is not null' into a predicate on column.
+# AND binds tighter than OR.
+def parse_condition(column, condition):
+    any_of = []
+    all_of = []
+    position = 0
+    condition = condition.strip()
+    while True:
+        match = TERM.match(condition, position)
+        if match is None:
+            raise ValueError('Could not parse condition "' + condition + '" on ' + column)
+
+        if match.group('op'):
+            all_of.append(Comparison(column, match.group('op'), parse_literal(match.group('value'))))
+        elif match.group('values') is not None:
+            all_of.append(In(column, [parse_literal(value) for value in match.group('values').split(',')
+                                      if value.strip()]))
+        elif match.group('pattern') is not None:
+            all_of.append(Like(column, str(parse_literal(match.group('pattern')))))
+        elif match.group(0).strip().lower().startswith('is'):
+            all_of.append(IsNull(column, match.group('negated') is not None))
+        else:
+            all_of.append(Between(column, parse_literal(match.group('low')), parse_literal(match.group('high'))))
+
+        position = match.end()
+        if position == len(condition):
+            break
+        connector = CONNECTOR.match(condition, position)
+        if connector is None:
+            raise ValueError('Could not parse condition "' + condition + '" on ' + column)
+        if connector.group(1).lower() == 'or':
+            any_of.append(all_of)
+            all_of = []
+        position = connector.end()
+
+    any_of.append(all_of)
+    groups = [group[0] if len(group) == 1 else And(*group) for group in any_of]
+    return groups[0] if len(groups) == 1 else Or(*groups)
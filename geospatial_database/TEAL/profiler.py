@@ -0,0 +1,246 @@
+import json
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+SLOW_QUERY_MS = 100.0
+
+# Upper bounds, in milliseconds, of the latency buckets; the last bucket is open.
+BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 10000)
+
+# Only these statements have a query plan worth keeping.
+EXPLAINED = ('select', 'with', 'insert', 'update', 'delete', 'replace')
+
+MAX_PLANS = 1024
+
+ITER_BATCH_SIZE = 256
+
+
+class Histogram:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+
+    def add(self, seconds, rows=0):
+        self.count += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self.rows += rows
+        self.buckets[bisect_left(BUCKET_BOUNDS_MS, seconds * 1000)] += 1
+
+    def percentile(self, fraction):
+        # Upper bound of the bucket holding the given fraction of samples.
+        target = fraction * self.count
+        seen = 0
+        for bound, count in zip(BUCKET_BOUNDS_MS, self.buckets):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max_seconds * 1000)
+        return self.max_seconds * 1000
+
+    def summary(self):
+        return {'count': self.count,
+                'total_ms': self.seconds * 1000,
+                'mean_ms': self.seconds * 1000 / self.count if self.count else 0.0,
+                'p50_ms': self.percentile(0.5),
+                'p99_ms': self.percentile(0.99),
+                'max_ms': self.max_seconds * 1000,
+                'rows': self.rows,
+                'buckets': dict(zip([str(bound) for bound in BUCKET_BOUNDS_MS] + ['inf'], self.buckets))}
+
+
+class QueryProfiler:
+    def __init__(self, slow_ms=SLOW_QUERY_MS, slow_log=None, summary_path=None):
+        self.slow_ms = slow_ms
+        self.slow_log = None if slow_log is None else open(slow_log, 'a', buffering=1)
+        self.summary_path = summary_path
+        self.calls = defaultdict(Histogram)
+        self.statements = defaultdict(Histogram)
+        self.plans = {}
+        self.slow_count = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def active(self):
+        return getattr(self.local, 'method', None) is not None
+
+    def current_method(self):
+        return getattr(self.local, 'method', None) or 'sql'
+
+    @contextmanager
+    def calling(self, method_name):
+        self.local.method = method_name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.local.method = None
+            with self.lock:
+                self.calls[method_name].add(elapsed)
+
+    def explain(self, conn, sql, params):
+        plan = self.plans.get(sql)
+        if plan is not None or not sql.lstrip()[:7].lower().startswith(EXPLAINED):
+            return plan
+        try:
+            plan = [row[-1] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        except Exception:
+            plan = []
+        if len(self.plans) < MAX_PLANS:
+            self.plans[sql] = plan
+        return plan
+
+    def record(self, method_name, sql, params, seconds, rows):
+        with self.lock:
+            self.statements[(method_name, sql)].add(seconds, rows)
+            if seconds * 1000 < self.slow_ms:
+                return
+            self.slow_count += 1
+            if self.slow_log is not None:
+                entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                         'method': method_name,
+                         'ms': round(seconds * 1000, 3),
+                         'rows': rows,
+                         'sql': sql,
+                         'params': params if isinstance(params, dict) else list(params),
+                         'plan': self.plans.get(sql)}
+                self.slow_log.write(json.dumps(entry, default=str) + '\n')
+
+    def summary(self):
+        with self.lock:
+            return {'slow_ms': self.slow_ms,
+                    'slow_queries': self.slow_count,
+                    'methods': {name: histogram.summary() for name, histogram in self.calls.items()},
+                    'statements': [dict(histogram.summary(), method=method_name, sql=sql,
+                                        plan=self.plans.get(sql))
+                                   for (method_name, sql), histogram in self.statements.items()]}
+
+    def report(self, stream=sys.stdout, top=10):
+        with self.lock:
+            calls = sorted(self.calls.items(), key=lambda item: -item[1].seconds)
+            statements = sorted(self.statements.items(), key=lambda item: -item[1].seconds)[:top]
+
+        stream.write('Method calls (%d slow statements over %.1fms)\n' % (self.slow_count, self.slow_ms))
+        for name, histogram in calls:
+            stream.write('\t%-34s n=%-7d total=%.1fms p50<=%.2fms p99<=%.2fms max=%.2fms\n'
+                         % (name, histogram.count, histogram.seconds * 1000, histogram.percentile(0.5),
+                            histogram.percentile(0.99), histogram.max_seconds * 1000))
+            peak = max(histogram.buckets)
+            for bound, count in zip(BUCKET_BOUNDS_MS + (float('inf'),), histogram.buckets):
+                if count:
+                    stream.write('\t\t<=%-8s %-7d %s\n' % (bound, count, '#' * max(1, 40 * count // peak)))
+
+        stream.write('Top statements by total time\n')
+        for (method_name, sql), histogram in statements:
+            stream.write('\t%.1fms over %d runs, %d rows [%s] %s\n'
+                         % (histogram.seconds * 1000, histogram.count, histogram.rows, method_name,
+                            ' '.join(sql.split())))
+            for step in self.plans.get(sql) or ():
+                stream.write('\t\t' + step + '\n')
+
+    def dump(self, path):
+        with open(path, 'w') as summary_file:
+            json.dump(self.summary(), summary_file, indent=1)
+
+    def close(self):
+        if self.summary_path is not None:
+            self.dump(self.summary_path)
+        if self.slow_log is not None:
+            self.slow_log.close()
+            self.slow_log = None
+
+
+# Wraps a sqlite3 cursor. A statement's time is what is spent inside execute
+# and the fetches that read its rows; it is recorded once the rows run out or
+# the cursor moves on to the next statement.
+class ProfiledCursor:
+    def __init__(self, cursor, profiler):
+        self.cursor = cursor
+        self.profiler = profiler
+        self.pending = None
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        batch = self.fetchmany(ITER_BATCH_SIZE)
+        while batch:
+            yield from batch
+            batch = self.fetchmany(ITER_BATCH_SIZE)
+
+    def execute(self, sql, params=()):
+        self.finish()
+        method_name = self.profiler.current_method()
+        self.profiler.explain(self.cursor.connection, sql, params)
+        start = time.perf_counter()
+        self.cursor.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        if self.cursor.description is None:
+            self.profiler.record(method_name, sql, params, elapsed, max(self.cursor.rowcount, 0))
+        else:
+            self.pending = [method_name, sql, params, elapsed, 0]
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self.finish()
+        start = time.perf_counter()
+        self.cursor.executemany(sql, seq_of_params)
+        self.profiler.record(self.profiler.current_method(), sql, (), time.perf_counter() - start,
+                             max(self.cursor.rowcount, 0))
+        return self
+
+    def fetched(self, start, rows, done):
+        if self.pending is not None:
+            self.pending[3] += time.perf_counter() - start
+            self.pending[4] += rows
+            if done:
+                self.finish()
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        self.fetched(start, row is not None, row is None)
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.cursor.arraysize if size is None else size
+        start = time.perf_counter()
+        rows = self.cursor.fetchmany(size)
+        self.fetched(start, len(rows), len(rows) < size)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        self.fetched(start, len(rows), True)
+        return rows
+
+    def finish(self):
+        if self.pending is not None:
+            pending, self.pending = self.pending, None
+            self.profiler.record(*pending)
+
+    def close(self):
+        self.finish()
+        self.cursor.close()
+
+
+def profiled(method):
+    # Statements run by a method, and by the methods it calls, are counted
+    # against the outermost profiled method.
+    @wraps(method)
+    def call(self, *args, **kwargs):
+        profiler = self.profiler
+        if profiler is None or profiler.active():
+            return method(self, *args, **kwargs)
+        with profiler.calling(method.__name__):
+            return method(self, *args, **kwargs)
+    return call
@@ -1,49 +1,565 @@
 import sqlite3
 import csv
+import inspect
 import sys
-from final_project.TEAL import user_prompt
+import time
+from difflib import SequenceMatcher
+from pathlib import Path
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+from itertools import islice
+from final_project import util
+from final_project.TEAL import user_prompt, index_advisor, predicate, result_cache, btree, profiler
+
+BULK_BATCH_SIZE = 50000
+
+BULK_LOAD_PRAGMAS = {'synchronous': 'OFF',
+                     'journal_mode': 'MEMORY',
+                     'temp_store': 'MEMORY',
+                     'cache_size': -262144}
+
+# Without a sync or rollback journal a crash mid-load can corrupt the file, so
+# these are skipped when the database is kept between runs.
+UNSAFE_LOAD_PRAGMAS = ('synchronous', 'journal_mode')
+
+TABLE_COLUMNS = {'county': ('id', 'name', 'pop', 'growth_rate'),
+                 'owner': ('id', 'status', 'name'),
+                 'land': ('id', 'owner_id', 'county_id', 'rating', 'area'),
+                 'improvement': ('id', 'improvement_type', 'cost', 'improvement')}
+
+# Land CSVs of at least this size are parsed by a process pool; smaller ones
+# load faster than the workers take to start.
+PARALLEL_LOAD_BYTES = 64 << 20
+
+RESULT_BATCH_SIZE = 5000
+
+WRITE_BUFFER_SIZE = 1 << 20
+
+GROUP_COMMIT_OPS = 1000
+
+GROUP_COMMIT_MS = 200
+
+SCHEMA_VERSION = 7
+
+# Land ratings in land.csv run from 0 to 8; improvements cannot raise one past the top.
+MAX_RATING = 8
+
+TABLE_SCHEMAS = {'county': 'CREATE TABLE IF NOT EXISTS county '
+                           '(id INTEGER NOT NULL PRIMARY KEY, '
+                           'name VARCHAR, '
+                           'pop INTEGER, '
+                           'growth_rate FLOAT)',
+                 'owner': 'CREATE TABLE IF NOT EXISTS owner '
+                          '(id INTEGER NOT NULL PRIMARY KEY, '
+                          'status VARCHAR, '
+                          'name VARCHAR)',
+                 'land': 'CREATE TABLE IF NOT EXISTS land '
+                         '(id INTEGER NOT NULL PRIMARY KEY, '
+                         'owner_id INTEGER, '
+                         'county_id INTEGER, '
+                         'rating INTEGER, '
+                         'area INTEGER,'
+                         'FOREIGN KEY(owner_id) REFERENCES owner(id)'
+                         'FOREIGN KEY(county_id) REFERENCES county(id))',
+                 'improvement': 'CREATE TABLE IF NOT EXISTS improvement '
+                                '(id INTEGER NOT NULL PRIMARY KEY, '
+                                'improvement_type VARCHAR, '
+                                'cost FLOAT, '
+                                'improvement INTEGER)',
+                 'land_geometry': 'CREATE VIRTUAL TABLE IF NOT EXISTS land_geometry '
+                                  'USING rtree(id, min_x, max_x, min_y, max_y)',
+                 'county_rollup': 'CREATE TABLE IF NOT EXISTS county_rollup '
+                                  '(county_id INTEGER NOT NULL PRIMARY KEY, '
+                                  'land_count INTEGER, '
+                                  'rating_sum INTEGER, '
+                                  'rating_count INTEGER, '
+                                  'area_sum INTEGER, '
+                                  'area_count INTEGER)',
+                 'owner_rollup': 'CREATE TABLE IF NOT EXISTS owner_rollup '
+                                 '(owner_id INTEGER NOT NULL PRIMARY KEY, '
+                                 'land_count INTEGER, '
+                                 'rating_sum INTEGER, '
+                                 'rating_count INTEGER, '
+                                 'area_sum INTEGER, '
+                                 'area_count INTEGER)',
+                 'owner_county_rollup': 'CREATE TABLE IF NOT EXISTS owner_county_rollup '
+                                        '(owner_id INTEGER NOT NULL, '
+                                        'county_id INTEGER NOT NULL, '
+                                        'land_count INTEGER, '
+                                        'rating_sum INTEGER, '
+                                        'rating_count INTEGER, '
+                                        'area_sum INTEGER, '
+                                        'area_count INTEGER, '
+                                        'PRIMARY KEY(owner_id, county_id))',
+                 'county_rating_rollup': 'CREATE TABLE IF NOT EXISTS county_rating_rollup '
+                                         '(county_id INTEGER NOT NULL, '
+                                         'rating INTEGER NOT NULL, '
+                                         'land_count INTEGER, '
+                                         'PRIMARY KEY(county_id, rating))',
+                 'owner_name_index': 'CREATE VIRTUAL TABLE IF NOT EXISTS owner_name_index '
+                                     "USING fts5(name, content='owner', content_rowid='id', tokenize='trigram')",
+                 'county_name_index': 'CREATE VIRTUAL TABLE IF NOT EXISTS county_name_index '
+                                      "USING fts5(name, content='county', content_rowid='id', tokenize='trigram')",
+                 'land_cube': 'CREATE TABLE IF NOT EXISTS land_cube '
+                              '(county_id INTEGER NOT NULL, '
+                              'status VARCHAR, '
+                              'rating_bucket INTEGER, '
+                              'land_count INTEGER, '
+                              'rating_sum INTEGER, '
+                              'area_sum INTEGER)',
+                 'land_cube_dirty': 'CREATE TABLE IF NOT EXISTS land_cube_dirty '
+                                    '(county_id INTEGER NOT NULL PRIMARY KEY)'}
+
+# Trigram FTS5 indexes over owner.name and county.name; they match substrings
+# of three or more characters regardless of case.
+NAME_INDEXES = {'owner': 'owner_name_index',
+                'county': 'county_name_index'}
+
+NAME_SEARCH_LIMIT = 50
+
+NAME_SEARCH_MODES = ('exact', 'nocase', 'prefix', 'contains', 'fuzzy')
+
+# Extra condition each mode puts on the rows the index matches.
+NAME_FILTERS = {'exact': 'name = :text',
+                'nocase': 'lower(name) = lower(:text)',
+                'prefix': 'substr(lower(name), 1, length(:text)) = lower(:text)',
+                'contains': 'instr(lower(name), lower(:text)) > 0'}
+
+FUZZY_CANDIDATES = 200
+
+FUZZY_MIN_SCORE = 0.5
+
+# Each rollup is keyed by a group of land columns and keeps a parcel count,
+# optionally with rating and area sums. Parcels with a NULL key are left out,
+# and a sum only counts non-NULL values, like SUM and AVG over land would.
+ROLLUPS = {'county_rollup': (('county_id',), True),
+           'owner_rollup': (('owner_id',), True),
+           'owner_county_rollup': (('owner_id', 'county_id'), True),
+           'county_rating_rollup': (('county_id', 'rating'), False)}
+
+ROLLUP_MEASURES = ('rating_sum', 'rating_count', 'area_sum', 'area_count')
+
+
+def rollup_values(row):
+    return ['coalesce(' + row + '.rating, 0)', '(' + row + '.rating IS NOT NULL)',
+            'coalesce(' + row + '.area, 0)', '(' + row + '.area IS NOT NULL)']
+
+
+def rollup_add(rollup, row):
+    keys, sums = ROLLUPS[rollup]
+    columns = list(keys) + ['land_count']
+    values = [row + '.' + key for key in keys] + ['1']
+    updates = ['land_count = land_count + 1']
+    if sums:
+        columns += ROLLUP_MEASURES
+        values += rollup_values(row)
+        updates += [measure + ' = ' + measure + ' + excluded.' + measure for measure in ROLLUP_MEASURES]
+    return ('INSERT INTO ' + rollup + ' (' + ', '.join(columns) + ') '
+            'SELECT ' + ', '.join(values) + ' '
+            'WHERE ' + ' AND '.join(row + '.' + key + ' IS NOT NULL' for key in keys) + ' '
+            'ON CONFLICT(' + ', '.join(keys) + ') DO UPDATE SET ' + ', '.join(updates) + '; ')
+
+
+def rollup_remove(rollup, row):
+    # A NULL key matches no group, so such a row is skipped here too.
+    keys, sums = ROLLUPS[rollup]
+    updates = ['land_count = land_count - 1']
+    if sums:
+        updates += [measure + ' = ' + measure + ' - ' + value
+                    for measure, value in zip(ROLLUP_MEASURES, rollup_values(row))]
+    match = ' AND '.join(key + ' = ' + row + '.' + key for key in keys)
+    return ('UPDATE ' + rollup + ' SET ' + ', '.join(updates) + ' WHERE ' + match + '; '
+            'DELETE FROM ' + rollup + ' WHERE ' + match + ' AND land_count <= 0; ')
+
+
+def rollup_rebuild(rollup):
+    keys, sums = ROLLUPS[rollup]
+    measures = ['COUNT(*)'] + (['coalesce(SUM(rating), 0)', 'COUNT(rating)', 'coalesce(SUM(area), 0)',
+                                'COUNT(area)'] if sums else [])
+    columns = list(keys) + ['land_count'] + (list(ROLLUP_MEASURES) if sums else [])
+    return ('INSERT INTO ' + rollup + ' (' + ', '.join(columns) + ') '
+            'SELECT ' + ', '.join(list(keys) + measures) + ' FROM land '
+            'WHERE ' + ' AND '.join(key + ' IS NOT NULL' for key in keys) + ' '
+            'GROUP BY ' + ', '.join(keys))
+
+TABLE_TRIGGERS = {'land': {'land_geometry_delete': 'CREATE TRIGGER IF NOT EXISTS land_geometry_delete '
+                                                   'AFTER DELETE ON land BEGIN '
+                                                   'DELETE FROM land_geometry WHERE id = OLD.id; '
+                                                   'END',
+                           'land_rollup_insert': 'CREATE TRIGGER IF NOT EXISTS land_rollup_insert '
+                                                 'AFTER INSERT ON land BEGIN ' +
+                                                 ''.join(rollup_add(rollup, 'NEW') for rollup in ROLLUPS) +
+                                                 'END',
+                           'land_rollup_delete': 'CREATE TRIGGER IF NOT EXISTS land_rollup_delete '
+                                                 'AFTER DELETE ON land BEGIN ' +
+                                                 ''.join(rollup_remove(rollup, 'OLD') for rollup in ROLLUPS) +
+                                                 'END',
+                           'land_rollup_update': 'CREATE TRIGGER IF NOT EXISTS land_rollup_update '
+                                                 'AFTER UPDATE OF owner_id, county_id, rating, area ON land BEGIN ' +
+                                                 ''.join(rollup_remove(rollup, 'OLD') for rollup in ROLLUPS) +
+                                                 ''.join(rollup_add(rollup, 'NEW') for rollup in ROLLUPS) +
+                                                 'END'}}
+
+
+def name_index_triggers(table_name):
+    index = NAME_INDEXES[table_name]
+    remove = ('INSERT INTO ' + index + ' (' + index + ', rowid, name) '
+              "VALUES ('delete', OLD.id, OLD.name); ")
+    add = 'INSERT INTO ' + index + ' (rowid, name) VALUES (NEW.id, NEW.name); '
+    return {index + '_insert': 'CREATE TRIGGER IF NOT EXISTS ' + index + '_insert '
+                               'AFTER INSERT ON ' + table_name + ' BEGIN ' + add + 'END',
+            index + '_delete': 'CREATE TRIGGER IF NOT EXISTS ' + index + '_delete '
+                               'AFTER DELETE ON ' + table_name + ' BEGIN ' + remove + 'END',
+            index + '_update': 'CREATE TRIGGER IF NOT EXISTS ' + index + '_update '
+                               'AFTER UPDATE OF id, name ON ' + table_name + ' BEGIN ' + remove + add + 'END'}
+
+
+TABLE_TRIGGERS.update((table_name, name_index_triggers(table_name)) for table_name in NAME_INDEXES)
+
+# land_cube holds land counts and sums per county, owner status and rating
+# bucket. Writes to land or owner only mark the counties they affect in
+# land_cube_dirty; those counties are regrouped on the next cube query.
+CUBE_DIMENSIONS = {'county': 'county_id',
+                   'status': 'status',
+                   'rating_bucket': 'rating_bucket'}
+
+# Bucket b holds ratings from b * CUBE_RATING_BUCKET to (b + 1) * CUBE_RATING_BUCKET - 1.
+CUBE_RATING_BUCKET = 3
+
+CUBE_MARK_ALL = 'INSERT OR IGNORE INTO land_cube_dirty (county_id) SELECT DISTINCT county_id FROM land'
+
+CUBE_REFRESH = ('DELETE FROM land_cube WHERE county_id IN (SELECT county_id FROM land_cube_dirty)',
+                'INSERT INTO land_cube (county_id, status, rating_bucket, land_count, rating_sum, area_sum) '
+                'SELECT L.county_id, O.status, L.rating / ' + str(CUBE_RATING_BUCKET) + ', '
+                'COUNT(*), SUM(L.rating), SUM(L.area) '
+                'FROM land L '
+                'LEFT JOIN owner O '
+                'ON O.id = L.owner_id '
+                'WHERE L.county_id IN (SELECT county_id FROM land_cube_dirty) '
+                'GROUP BY 1, 2, 3',
+                'DELETE FROM land_cube_dirty')
+
+
+def cube_mark_land(row):
+    return 'INSERT OR IGNORE INTO land_cube_dirty (county_id) VALUES (' + row + '.county_id); '
+
+
+def cube_mark_owner(row):
+    return ('INSERT OR IGNORE INTO land_cube_dirty (county_id) '
+            'SELECT DISTINCT county_id FROM land WHERE owner_id = ' + row + '.id; ')
+
+
+TABLE_TRIGGERS['land'].update({'land_cube_insert': 'CREATE TRIGGER IF NOT EXISTS land_cube_insert '
+                                                   'AFTER INSERT ON land BEGIN ' + cube_mark_land('NEW') + 'END',
+                               'land_cube_delete': 'CREATE TRIGGER IF NOT EXISTS land_cube_delete '
+                                                   'AFTER DELETE ON land BEGIN ' + cube_mark_land('OLD') + 'END',
+                               'land_cube_update': 'CREATE TRIGGER IF NOT EXISTS land_cube_update '
+                                                   'AFTER UPDATE OF owner_id, county_id, rating, area ON land BEGIN ' +
+                                                   cube_mark_land('OLD') + cube_mark_land('NEW') + 'END'})
+
+TABLE_TRIGGERS['owner'].update({'owner_cube_insert': 'CREATE TRIGGER IF NOT EXISTS owner_cube_insert '
+                                                     'AFTER INSERT ON owner BEGIN ' + cube_mark_owner('NEW') + 'END',
+                                'owner_cube_delete': 'CREATE TRIGGER IF NOT EXISTS owner_cube_delete '
+                                                     'AFTER DELETE ON owner BEGIN ' + cube_mark_owner('OLD') + 'END',
+                                'owner_cube_update': 'CREATE TRIGGER IF NOT EXISTS owner_cube_update '
+                                                     'AFTER UPDATE OF id, status ON owner BEGIN ' +
+                                                     cube_mark_owner('OLD') + cube_mark_owner('NEW') + 'END'})
+
+# Tables derived from another table's rows, emptied whenever that table is replaced.
+DEPENDENT_TABLES = {'land': ('land_geometry', 'land_cube') + tuple(ROLLUPS)}
+
+GEOMETRY_INSERT = ('INSERT OR REPLACE INTO land_geometry (id, min_x, max_x, min_y, max_y) '
+                   'VALUES (?, ?, ?, ?, ?)')
+
+# Squared distance from (x, y) to the nearest edge of a parcel's bounding box, 0 inside it.
+BOX_DISTANCE = ('(max(G.min_x - :x, 0, :x - G.max_x) * max(G.min_x - :x, 0, :x - G.max_x) + '
+                'max(G.min_y - :y, 0, :y - G.max_y) * max(G.min_y - :y, 0, :y - G.max_y))')
+
+# land(county_id, rating) also serves plain county_id lookups, so county_id
+# does not get an index of its own.
+TABLE_INDEXES = {'land': {'land_county_rating': ('county_id', 'rating'),
+                          'land_owner_id': ('owner_id',),
+                          'land_rating': ('rating',),
+                          'land_area': ('area',)},
+                 'land_cube': {'land_cube_county': ('county_id',)}}
+
+# Tables an export reads; they are materialized before the export starts.
+EXPORT_TABLES = ('land', 'owner', 'county')
+
+PROFILED_METHODS = ('get_land_by_county', 'get_land_by_area', 'get_land_by_owner', 'get_land_by_quality_rating',
+                    'view_land_details', 'get_average_rating_county', 'get_area_by_owner', 'get_owners_in_county',
+                    'get_critical_land_count_by_county', 'get_land_by_status', 'generic_query', 'select',
+                    'get_page', 'get_land_in_box', 'get_land_at_point', 'get_nearest_land', 'search_names',
+                    'insert_table', 'delete_table', 'delete_item', 'delete_where', 'delete_by_name', 'update_where',
+                    'modify_item', 'apply_improvement', 'reassign_owner', 'load_table', 'bulk_load',
+                    'insert_into_land', 'insert_land_geometry', 'insert_into_county', 'insert_into_improvement',
+                    'insert_into_owner', 'create_advised_indexes', 'get_district_stats_by_county',
+                    'get_land_cube', 'plan_improvements', 'build_land_index', 'commit')
+
+
+def land_bounds(rows):
+    # Land rows may carry min_x, max_x, min_y, max_y or an x, y centroid after area.
+    for row in rows:
+        if len(row) >= 9 and row[5]:
+            yield row[0], row[5], row[6], row[7], row[8]
+        elif len(row) >= 7 and row[5]:
+            yield row[0], row[5], row[5], row[6], row[6]
+
+
+def land_box(land_id, min_x, max_x, min_y, max_y):
+    box = (int(land_id), float(min_x), float(max_x), float(min_y), float(max_y))
+    if box[1] > box[2] or box[3] > box[4]:
+        raise ValueError('Bounds of land ' + str(land_id) + ' have a minimum above the maximum')
+    return box
+
+
+def cached_query(*tables):
+    # Serves a read method from Database.cache while none of tables has been
+    # written since the result was stored.
+    def wrap(method):
+        signature = inspect.signature(method)
+
+        @wraps(method)
+        def query(self, *args, **kwargs):
+            # Arguments are bound with their defaults filled in, so f(1, k=2)
+            # and f(1, 2) share one cache entry.
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            key = (method.__name__,) + bound.args[1:] + tuple(sorted(bound.kwargs.items()))
+            self.materialize(*tables)
+            return self.cached(key, tables, lambda: method(*bound.args, **bound.kwargs))
+        return query
+    return wrap
 
 
 class Database:
-    def __init__(self, database_file):
+    bulk_load_pragmas = BULK_LOAD_PRAGMAS
+    parallel_load_bytes = PARALLEL_LOAD_BYTES
+    parallel_load_workers = None
+
+    def __init__(self, database_file, persistent=False):
         self.db_file = database_file
+        self.persistent = persistent
+        self.load_stats = {}
+        self.advisor = index_advisor.IndexAdvisor()
+        self.statements = predicate.StatementCache()
+        self.districts = None
+        self.district_counties = None
+        self.district_population_version = None
+        self.extent = None
+        self.cache = None
+        self.generations = defaultdict(int)
+        self.result_rows = None
+        self.transaction_depth = 0
+        self.transaction_tables = set()
+        self.group_commit_ops = None
+        self.group_commit_ms = None
+        self.pending_writes = 0
+        self.first_pending_write = None
+        self.profiler = None
+        self.sources = {}
         try:
-            self.conn = sqlite3.connect(self.db_file)
-            self.cur = self.conn.cursor()
-
-            self.cur.execute('DROP TABLE IF EXISTS county')
-            self.cur.execute('DROP TABLE IF EXISTS land')
-            self.cur.execute('DROP TABLE IF EXISTS improvement')
-            self.cur.execute('DROP TABLE IF EXISTS owner')
-
-            self.cur.execute('CREATE TABLE IF NOT EXISTS county '
-                             '(id INTEGER NOT NULL PRIMARY KEY, '
-                             'name VARCHAR, '
-                             'pop INTEGER, '
-                             'growth_rate FLOAT)')
-            self.cur.execute('CREATE TABLE IF NOT EXISTS owner '
-                             '(id INTEGER NOT NULL PRIMARY KEY, '
-                             'status VARCHAR, '
-                             'name VARCHAR)')
-            self.cur.execute('CREATE TABLE IF NOT EXISTS land '
-                             '(id INTEGER NOT NULL PRIMARY KEY, '
-                             'owner_id INTEGER, '
-                             'county_id INTEGER, '
-                             'rating INTEGER, '
-                             'area INTEGER,'
-                             'FOREIGN KEY(owner_id) REFERENCES owner(id)'
-                             'FOREIGN KEY(county_id) REFERENCES county(id))')
-            self.cur.execute('CREATE TABLE IF NOT EXISTS improvement '
-                             '(id INTEGER NOT NULL PRIMARY KEY, '
-                             'improvement_type VARCHAR, '
-                             'cost FLOAT, '
-                             'improvement INTEGER)')
+            self.conn = self.connect()
+            self.cur = self.cursor()
+
+            if not self.persistent or self.get_schema_version() != SCHEMA_VERSION:
+                for table_name in TABLE_SCHEMAS:
+                    self.cur.execute('DROP TABLE IF EXISTS ' + table_name)
+                self.cur.execute('DROP TABLE IF EXISTS source_manifest')
+
+            self.create_tables()
 
         except Exception as e:
             print("The program encountered the following exception while trying"
                   " to initialize the database: ", e)
             user_prompt.user_prompt()
 
+    def connect(self):
+        return sqlite3.connect(self.db_file, cached_statements=predicate.STATEMENT_CACHE_SIZE)
+
+    def cursor(self, conn=None):
+        cur = (conn or self.conn).cursor()
+        if self.profiler is not None:
+            cur = profiler.ProfiledCursor(cur, self.profiler)
+        return cur
+
+    def create_tables(self):
+        for table_name, schema in TABLE_SCHEMAS.items():
+            self.cur.execute(schema)
+            self.create_indexes(table_name)
+        for table_name in TABLE_TRIGGERS:
+            self.create_triggers(table_name)
+        self.cur.execute('CREATE TABLE IF NOT EXISTS source_manifest '
+                         '(table_name VARCHAR NOT NULL PRIMARY KEY, '
+                         'source_path VARCHAR, '
+                         'size INTEGER, '
+                         'mtime INTEGER, '
+                         'sha256 VARCHAR)')
+        self.cur.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+        self.conn.commit()
+
+    def create_indexes(self, table_name):
+        for index_name, columns in TABLE_INDEXES.get(table_name, {}).items():
+            self.cur.execute('CREATE INDEX IF NOT EXISTS ' + index_name + ' ON ' + table_name +
+                             ' (' + ', '.join(columns) + ')')
+
+    def drop_indexes(self, table_name):
+        for index_name in TABLE_INDEXES.get(table_name, {}):
+            self.cur.execute('DROP INDEX IF EXISTS ' + index_name)
+
+    def create_triggers(self, table_name):
+        for trigger in TABLE_TRIGGERS.get(table_name, {}).values():
+            self.cur.execute(trigger)
+
+    def drop_triggers(self, table_name):
+        for trigger_name in TABLE_TRIGGERS.get(table_name, {}):
+            self.cur.execute('DROP TRIGGER IF EXISTS ' + trigger_name)
+
+    def propose_indexes(self):
+        return self.advisor.propose(self.cur)
+
+    def create_advised_indexes(self):
+        created = self.advisor.apply(self.cur)
+        self.conn.commit()
+        for index_name, table_name, column, count in created:
+            sys.stdout.write('Created index ' + index_name + ' on ' + table_name + '(' + column + ') '
+                             'after ' + str(count) + ' queries\n')
+        return created
+
+    def enable_result_cache(self, max_entries=result_cache.CACHE_MAX_ENTRIES,
+                            max_bytes=result_cache.CACHE_MAX_BYTES):
+        self.cache = result_cache.ResultCache(max_entries, max_bytes)
+
+    def enable_profiling(self, slow_ms=profiler.SLOW_QUERY_MS, slow_log=None, summary_path=None):
+        # Every statement is timed and its plan captured; statements slower
+        # than slow_ms are appended to slow_log as JSON lines.
+        self.profiler = profiler.QueryProfiler(slow_ms, slow_log, summary_path)
+        self.cur = self.cursor()
+        return self.profiler
+
+    def register_source(self, table_name, csv_path, *args):
+        # The table is loaded from csv_path the first time a query, insert,
+        # update or delete touches it. district takes load_district_data's
+        # remaining arguments after the CSV.
+        self.sources[table_name] = (csv_path,) + args
+
+    def materialize(self, *table_names):
+        for table_name in table_names:
+            if table_name not in self.sources:
+                continue
+            if self.transaction_depth:
+                # A load commits, which would end the caller's transaction early.
+                raise ValueError('Cannot load ' + table_name + ' inside a transaction')
+            source = self.sources.pop(table_name)
+            if table_name == 'district':
+                self.load_district_data(*source)
+            else:
+                self.load_table(table_name, *source)
+
+    def touch(self, table_name):
+        self.generations[table_name] += 1
+        if self.transaction_depth:
+            self.transaction_tables.add(table_name)
+        if self.group_commit_ops is None or self.transaction_depth:
+            return
+
+        now = time.perf_counter()
+        if self.pending_writes == 0:
+            self.first_pending_write = now
+        self.pending_writes += 1
+        if (self.pending_writes >= self.group_commit_ops or
+                (now - self.first_pending_write) * 1000 >= self.group_commit_ms):
+            self.commit()
+
+    def enable_group_commit(self, max_ops=GROUP_COMMIT_OPS, max_ms=GROUP_COMMIT_MS):
+        # Writes stay in one open transaction until max_ops of them are pending
+        # or the oldest is max_ms old. The age is checked as each write
+        # arrives and by flush(), which the prompt and batch loops call
+        # between commands and PooledDatabase calls from its flush thread.
+        self.group_commit_ops = max_ops
+        self.group_commit_ms = max_ms
+
+    def disable_group_commit(self):
+        self.commit()
+        self.group_commit_ops = None
+        self.group_commit_ms = None
+
+    def commit(self):
+        if self.conn.in_transaction:
+            self.conn.commit()
+        self.pending_writes = 0
+        self.first_pending_write = None
+
+    def flush(self):
+        if (self.pending_writes and self.group_commit_ms is not None and
+                (time.perf_counter() - self.first_pending_write) * 1000 >= self.group_commit_ms):
+            self.commit()
+
+    @contextmanager
+    def transaction(self):
+        if self.transaction_depth == 0:
+            # Loading a registered table commits, so it is done before BEGIN.
+            self.materialize(*self.sources)
+            self.commit()
+            self.transaction_tables = set()
+            self.cur.execute('BEGIN')
+        else:
+            savepoint = 'teal_savepoint_' + str(self.transaction_depth)
+            self.cur.execute('SAVEPOINT ' + savepoint)
+
+        self.transaction_depth += 1
+        try:
+            yield self.cur
+        except Exception:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.conn.rollback()
+            else:
+                self.cur.execute('ROLLBACK TO ' + savepoint)
+                self.cur.execute('RELEASE ' + savepoint)
+            # Results cached from the rolled back writes are stale now; every
+            # table written since BEGIN is invalidated, savepoint or not.
+            for table_name in self.transaction_tables:
+                self.generations[table_name] += 1
+            raise
+        else:
+            self.transaction_depth -= 1
+            if self.transaction_depth == 0:
+                self.conn.commit()
+            else:
+                self.cur.execute('RELEASE ' + savepoint)
+
+    def savepoint(self):
+        if self.transaction_depth == 0:
+            raise ValueError('A savepoint needs an enclosing transaction')
+        return self.transaction()
+
+    def close(self):
+        self.commit()
+        self.conn.close()
+        if self.profiler is not None:
+            self.profiler.close()
+
+    def cached(self, key, tables, run):
+        if self.cache is None:
+            # The rows are left on the cursor, so rows kept from an earlier
+            # read must not be what iter_batches hands out next.
+            self.result_rows = None
+            run()
+            return None
+
+        rows = self.cache.get(key, self.generations)
+        if rows is None:
+            run()
+            rows = self.cur.fetchall()
+            self.cache.put(key, tables, self.generations, rows)
+        self.result_rows = rows
+        return rows
+
+    def get_schema_version(self):
+        return self.cur.execute('PRAGMA user_version').fetchone()[0]
+
     def insert_table(self, table_name, cols):
         self.cur.execute('DROP TABLE IF EXISTS ' + table_name)
         self.cur.execute('CREATE TABLE IF NOT EXISTS ' + table_name +
@@ -52,92 +568,603 @@ class Database:
         for name, data_type in zip(cols.keys(), cols.values()):
             self.cur.execute('DECLARE ' + table_name + ' TABLE ' + name + ' ' + data_type)
 
+        self.touch(table_name)
         sys.stdout.write('Successfully inserted table ' + table_name + '\n')
 
     def delete_table(self, table_name):
+        # A table that was never loaded is dropped without reading its CSV.
+        self.sources.pop(table_name, None)
+        if table_name in NAME_INDEXES:
+            self.cur.execute('INSERT INTO ' + NAME_INDEXES[table_name] + ' (' + NAME_INDEXES[table_name] + ') '
+                             "VALUES ('delete-all')")
         self.cur.execute('DROP TABLE IF EXISTS ' + table_name)
+        for dependent in DEPENDENT_TABLES.get(table_name, ()):
+            self.cur.execute('DELETE FROM ' + dependent)
+        if table_name == 'owner':
+            # Dropping owner skips its cube triggers, so every county's status cells are regrouped.
+            self.cur.execute(CUBE_MARK_ALL)
+        self.cur.execute('DELETE FROM source_manifest WHERE table_name = ?', (table_name,))
+        self.touch(table_name)
         sys.stdout.write('Successfully deleted ' + table_name + '\n')
 
     def delete_item(self, table_name, col, condition):
-        self.cur.execute('DELETE FROM ' + table_name + ' WHERE ' + col + condition)
+        self.delete_where(table_name, predicate.parse_condition(col.strip(), condition))
         sys.stdout.write('Successfully deleted ' + condition + ' from ' + col + ' in ' + table_name + '\n')
 
+    def delete_where(self, table_name, where):
+        self.materialize(table_name)
+        query = self.statements.get(('delete', table_name, where.shape()),
+                                    lambda: 'DELETE FROM ' + self.checked_table(table_name, where) +
+                                            ' WHERE ' + where.sql())
+        self.cur.execute(query, where.params())
+        self.touch(table_name)
+        return self.cur.rowcount
+
+    def update_where(self, table_name, assignments, where=None):
+        self.materialize(table_name)
+        names = tuple(assignments)
+
+        def build():
+            columns = index_advisor.table_columns(self.cur, table_name)
+            for name in names:
+                if name.lower() not in columns:
+                    raise ValueError('No such column in ' + table_name + ': ' + name)
+                if name.lower() == 'id':
+                    raise ValueError('ids cannot be modified; delete and insert the row instead')
+            query = 'UPDATE ' + self.checked_table(table_name, where) + ' SET '
+            query += ', '.join(name + ' = ?' for name in names)
+            if where is not None:
+                query += ' WHERE ' + where.sql()
+            return query
+
+        query = self.statements.get(('update', table_name, names, None if where is None else where.shape()), build)
+        params = [assignments[name] for name in names] + ([] if where is None else list(where.params()))
+        self.cur.execute(query, params)
+        self.touch(table_name)
+        return self.cur.rowcount
+
+    def modify_item(self, table_name, col, condition, assignments):
+        modified = self.update_where(table_name, assignments, predicate.parse_condition(col.strip(), condition))
+        sys.stdout.write('Modified %d rows where %s %s in %s\n' % (modified, col, condition, table_name))
+        return modified
+
+    def apply_improvement(self, improvement_id, max_rating, county_id=None):
+        # One UPDATE raises every matching parcel's rating by the improvement
+        # level; the rollup triggers keep the per-county aggregates current.
+        self.materialize('land', 'improvement')
+        self.cur.execute('SELECT improvement FROM improvement WHERE id = ?', (int(improvement_id),))
+        improvement = self.cur.fetchone()
+        if improvement is None:
+            raise ValueError('No such improvement: ' + str(improvement_id))
+
+        where = predicate.Comparison('rating', '<=', int(max_rating))
+        if county_id is not None:
+            where = predicate.And(where, predicate.Comparison('county_id', '=', int(county_id)))
+        query = self.statements.get(('improve', where.shape()),
+                                    lambda: 'UPDATE land SET rating = min(rating + ?, ?) WHERE ' + where.sql())
+        self.cur.execute(query, [improvement[0], MAX_RATING] + list(where.params()))
+        self.touch('land')
+        sys.stdout.write('Applied improvement %s to %d parcels\n' % (improvement_id, self.cur.rowcount))
+        return self.cur.rowcount
+
+    def reassign_owner(self, from_owner_id, to_owner_id):
+        self.materialize('owner')
+        self.cur.execute('SELECT 1 FROM owner WHERE id = ?', (int(to_owner_id),))
+        if self.cur.fetchone() is None:
+            raise ValueError('No such owner: ' + str(to_owner_id))
+
+        modified = self.update_where('land', {'owner_id': int(to_owner_id)},
+                                     predicate.Comparison('owner_id', '=', int(from_owner_id)))
+        sys.stdout.write('Reassigned %d parcels from owner %s to owner %s\n' % (modified, from_owner_id, to_owner_id))
+        return modified
+
+    def delete_by_name(self, table_name, name):
+        ids = self.name_ids(table_name, name)
+        deleted = self.delete_where(table_name, predicate.In('id', ids)) if ids else 0
+        sys.stdout.write('Successfully deleted %d rows named %s from %s\n' % (deleted, name, table_name))
+        return deleted
+
+    def search_names(self, table_name, text, mode='prefix', limit=NAME_SEARCH_LIMIT):
+        rows = self.lookup_names(table_name, text, mode, limit)
+        self.result_rows = rows
+        return rows
+
+    def name_ids(self, table_name, name):
+        # Exact and case-sensitive, like the name = ? comparisons it replaces.
+        return [row[0] for row in self.lookup_names(table_name, name, 'exact', None)]
+
+    def lookup_names(self, table_name, text, mode, limit):
+        if table_name not in NAME_INDEXES:
+            raise ValueError('No name index on ' + table_name)
+        if mode not in NAME_SEARCH_MODES:
+            raise ValueError('Name search mode must be one of ' + ', '.join(NAME_SEARCH_MODES))
+        if mode == 'fuzzy':
+            return self.fuzzy_names(table_name, text, limit)
+
+        self.materialize(table_name)
+        index = NAME_INDEXES[table_name]
+        params = {'text': text, 'phrase': '"' + text.replace('"', '""') + '"', 'limit': -1 if limit is None else limit}
+        if len(text) >= 3:
+            self.cur.execute('SELECT rowid, name FROM ' + index + ' '
+                             'WHERE ' + index + ' MATCH :phrase AND ' + NAME_FILTERS[mode] + ' LIMIT :limit', params)
+        else:
+            # Trigrams need three characters; shorter names are looked up by scan.
+            self.cur.execute('SELECT id, name FROM ' + table_name + ' '
+                             'WHERE ' + NAME_FILTERS[mode] + ' LIMIT :limit', params)
+        return self.cur.fetchall()
+
+    def fuzzy_names(self, table_name, text, limit):
+        # Names sharing the most trigrams with text are the candidates; they
+        # are then ranked by similarity, so misspellings still resolve.
+        folded = text.lower()
+        grams = sorted({folded[start:start + 3] for start in range(len(folded) - 2)})
+        if not grams:
+            return self.lookup_names(table_name, text, 'prefix', limit)
+
+        self.materialize(table_name)
+        index = NAME_INDEXES[table_name]
+        self.cur.execute('SELECT rowid, name FROM ' + index + ' WHERE ' + index + ' MATCH ? ORDER BY rank LIMIT ?',
+                         (' OR '.join('"' + gram.replace('"', '""') + '"' for gram in grams), FUZZY_CANDIDATES))
+        scored = [(row_id, name, SequenceMatcher(None, folded, name.lower()).ratio())
+                  for row_id, name in self.cur.fetchall()]
+        scored = sorted((row for row in scored if row[2] >= FUZZY_MIN_SCORE), key=lambda row: -row[2])
+        return scored if limit is None else scored[:limit]
+
+    def select(self, table_name, where=None, distinct=False):
+        self.materialize(table_name)
+        def build():
+            query = 'SELECT DISTINCT * FROM ' if distinct else 'SELECT * FROM '
+            query += self.checked_table(table_name, where)
+            if where is not None:
+                query += ' WHERE ' + where.sql()
+            return query
+
+        shape = None if where is None else where.shape()
+        params = [] if where is None else where.params()
+        query = self.statements.get(('select', table_name, distinct, shape), build)
+        if where is not None:
+            for column, operator in where.terms():
+                self.advisor.record(table_name, column, operator)
+        return self.cached((query, tuple(params)), (table_name,), lambda: self.cur.execute(query, params))
+
+    def checked_table(self, table_name, where):
+        # Identifiers cannot be bound, so they are checked against the schema
+        # once per statement shape before being spliced into the SQL.
+        columns = index_advisor.table_columns(self.cur, table_name)
+        if not columns:
+            raise ValueError('No such table: ' + table_name)
+        if where is not None:
+            for column, _ in where.terms():
+                if column.lower() not in columns:
+                    raise ValueError('No such column in ' + table_name + ': ' + column)
+        return table_name
+
     def load_land_data(self, land_csv):
-        with land_csv.open('r') as land_csv:
-            read_csv = csv.reader(land_csv, delimiter=',')
-            first_line = True
-            for row in read_csv:
-                if first_line:
-                    first_line = False
-                    continue
-                self.insert_into_land(row[0], row[1], row[2], row[3], row[4])
+        self.load_table('land', land_csv)
 
     def load_county_data(self, county_csv):
-        with county_csv.open('r') as county_csv:
-            read_csv = csv.reader(county_csv, delimiter=',')
-            first_line = True
-            for row in read_csv:
-                if first_line:
-                    first_line = False
-                    continue
-                self.insert_into_county(row[0], row[1], row[2], row[3])
+        self.load_table('county', county_csv)
 
     def load_improvement_data(self, improve_csv):
-        with improve_csv.open('r') as improve_csv:
-            read_csv = csv.reader(improve_csv, delimiter=',')
-            first_line = True
-            for row in read_csv:
-                if first_line:
-                    first_line = False
-                    continue
-                self.insert_into_improvement(row[0], row[1], row[2], row[3])
+        self.load_table('improvement', improve_csv)
 
     def load_owner_data(self, owner_csv):
-        with owner_csv.open('r') as owner_csv:
-            read_csv = csv.reader(owner_csv, delimiter=',')
-            first_line = True
-            for row in read_csv:
-                if first_line:
-                    first_line = False
-                    continue
-                self.insert_into_owner(row[0], row[1], row[2])
-
-    def insert_into_land(self, land_id, owner_id, county_id, rating, area):
-        self.cur.execute('INSERT INTO land (id, owner_id, county_id, rating, area) '
+        self.load_table('owner', owner_csv)
+
+    def load_table(self, table_name, csv_path):
+        # Loading directly replaces whatever source was registered for the table.
+        self.sources.pop(table_name, None)
+        if self.persistent and not self.source_changed(table_name, csv_path):
+            sys.stdout.write('Reusing ' + table_name + ', ' + csv_path.name + ' is unchanged\n')
+            return 0
+
+        row_count = self.bulk_load(table_name, csv_path, replace=True)
+        if self.persistent:
+            self.record_source(table_name, csv_path)
+        return row_count
+
+    def source_changed(self, table_name, csv_path):
+        stat = csv_path.stat()
+        self.cur.execute('SELECT size, mtime, sha256 FROM source_manifest WHERE table_name = ?',
+                         (table_name,))
+        recorded = self.cur.fetchone()
+        if recorded is None or recorded[0] != stat.st_size:
+            return True
+        if recorded[1] == stat.st_mtime_ns:
+            return False
+
+        # The file was touched; only a content change forces a reload.
+        if recorded[2] != util.file_sha256(csv_path):
+            return True
+        self.cur.execute('UPDATE source_manifest SET mtime = ? WHERE table_name = ?',
+                         (stat.st_mtime_ns, table_name))
+        self.conn.commit()
+        return False
+
+    def record_source(self, table_name, csv_path):
+        stat = csv_path.stat()
+        self.cur.execute('INSERT OR REPLACE INTO source_manifest '
+                         '(table_name, source_path, size, mtime, sha256) '
                          'VALUES (?, ?, ?, ?, ?)',
-                         (int(land_id), int(owner_id), int(county_id), int(rating), int(area)))
+                         (table_name, str(csv_path), stat.st_size, stat.st_mtime_ns,
+                          util.file_sha256(csv_path)))
+        self.conn.commit()
+
+    def bulk_load(self, table_name, csv_path, batch_size=BULK_BATCH_SIZE, replace=False):
+        # Values are bound as the raw CSV strings; the INTEGER/FLOAT column
+        # affinities convert them inside SQLite instead of int()/float() per field.
+        columns = TABLE_COLUMNS[table_name]
+        insert = ('INSERT INTO ' + table_name + ' (' + ', '.join(columns) + ') '
+                  'VALUES (' + ', '.join('?' * len(columns)) + ')')
+
+        start = time.perf_counter()
+        row_count = 0
+        self.conn.commit()
+        saved_pragmas = self.set_pragmas({name: value for name, value in self.bulk_load_pragmas.items()
+                                          if not (self.persistent and name in UNSAFE_LOAD_PRAGMAS)})
+        try:
+            self.cur.execute('BEGIN')
+            # Building the indexes once after the load beats updating them per
+            # row, and dependent tables are filled here rather than by triggers.
+            self.drop_indexes(table_name)
+            self.drop_triggers(table_name)
+            if replace:
+                self.cur.execute('DELETE FROM ' + table_name)
+                for dependent in DEPENDENT_TABLES.get(table_name, ()):
+                    self.cur.execute('DELETE FROM ' + dependent)
+            for rows, bounds in self.read_batches(table_name, csv_path, batch_size):
+                self.cur.executemany(insert, rows)
+                if table_name == 'land':
+                    self.cur.executemany(GEOMETRY_INSERT, bounds)
+                row_count += len(rows)
+            self.check_numeric(table_name, csv_path)
+            if table_name == 'land':
+                self.rebuild_rollups()
+            if table_name in ('land', 'owner'):
+                # The load bypassed the cube triggers, so every county is regrouped.
+                self.cur.execute(CUBE_MARK_ALL)
+            if table_name in NAME_INDEXES:
+                self.cur.execute('INSERT INTO ' + NAME_INDEXES[table_name] + ' (' + NAME_INDEXES[table_name] + ') '
+                                 "VALUES ('rebuild')")
+            self.create_indexes(table_name)
+            self.create_triggers(table_name)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        finally:
+            self.set_pragmas(saved_pragmas)
+
+        self.touch(table_name)
+        elapsed = time.perf_counter() - start
+        rows_per_sec = row_count / elapsed if elapsed > 0 else float(row_count)
+        self.load_stats[table_name] = (row_count, elapsed, rows_per_sec)
+        sys.stdout.write('Loaded %d rows into %s in %.3fs (%.0f rows/sec)\n'
+                         % (row_count, table_name, elapsed, rows_per_sec))
+        return row_count
+
+    def read_batches(self, table_name, csv_path, batch_size=BULK_BATCH_SIZE):
+        column_count = len(TABLE_COLUMNS[table_name])
+        if table_name == 'land' and csv_path.stat().st_size >= self.parallel_load_bytes:
+            # Large numeric files are parsed by a process pool; this
+            # connection stays the only writer.
+            from final_project.TEAL import parallel_load
+
+            yield from parallel_load.iter_batches(csv_path, column_count, land_bounds, self.parallel_load_workers)
+            return
+
+        with csv_path.open('r') as csv_file:
+            read_csv = csv.reader(csv_file, delimiter=',')
+            next(read_csv, None)
+            rows = (row for row in read_csv if row)
+            batch = list(islice(rows, batch_size))
+            while batch:
+                yield [row[:column_count] for row in batch], land_bounds(batch)
+                batch = list(islice(rows, batch_size))
+
+    def check_numeric(self, table_name, csv_path):
+        # Affinity leaves a field it cannot convert as TEXT rather than failing,
+        # so the load is checked for them before it commits.
+        self.cur.execute('PRAGMA table_info(' + table_name + ')')
+        numeric = [row[1] for row in self.cur.fetchall() if row[2].upper() in ('INTEGER', 'FLOAT')]
+        if not numeric:
+            return
+        self.cur.execute('SELECT ' + ', '.join(numeric) + ' FROM ' + table_name + ' '
+                         'WHERE ' + ' OR '.join("typeof(" + column + ") = 'text'" for column in numeric) + ' '
+                         'LIMIT 1')
+        row = self.cur.fetchone()
+        if row is not None:
+            column, value = next((column, value) for column, value in zip(numeric, row) if isinstance(value, str))
+            raise ValueError('Malformed ' + column + ' in ' + csv_path.name + ': ' + repr(value))
+
+    def rebuild_rollups(self):
+        for rollup in ROLLUPS:
+            self.cur.execute('DELETE FROM ' + rollup)
+            self.cur.execute(rollup_rebuild(rollup))
+
+    def set_pragmas(self, pragmas):
+        previous = {}
+        for name, value in pragmas.items():
+            previous[name] = self.cur.execute('PRAGMA ' + name).fetchone()[0]
+            self.cur.execute('PRAGMA ' + name + ' = ' + str(value))
+        return previous
+
+    def load_district_data(self, district_csv, crosswalk_csv=None, store_dir=None):
+        # NumPy is only needed for the district store, so it is imported on first use.
+        from final_project.TEAL import district
+
+        self.sources.pop('district', None)
+        start = time.perf_counter()
+        self.districts = district.DistrictStore.open(district_csv, store_dir)
+        if crosswalk_csv is not None:
+            self.district_counties = self.districts.county_ids(crosswalk_csv)
+        self.touch('district')
+        sys.stdout.write('Opened %d districts x %d columns in %.3fs\n'
+                         % (len(self.districts), len(self.districts.column_names), time.perf_counter() - start))
+
+    @cached_query('county', 'district')
+    def get_district_stats_by_county(self, column, how='sum', weights=None):
+        if self.district_counties is None:
+            raise ValueError('District data must be loaded with a district to county crosswalk')
+
+        county_ids, values = self.districts.aggregate(column, self.district_counties, how, weights)
+        self.cur.execute('CREATE TEMP TABLE IF NOT EXISTS district_county_stats '
+                         '(county_id INTEGER NOT NULL PRIMARY KEY, '
+                         'value FLOAT)')
+        self.cur.execute('DELETE FROM district_county_stats')
+        self.cur.executemany('INSERT INTO district_county_stats (county_id, value) VALUES (?, ?)',
+                             zip(county_ids.tolist(), values.tolist()))
+        self.cur.execute('SELECT county.id, county.name, D.value AS ' + how + '_' + column + ' '
+                         'FROM district_county_stats D '
+                         'INNER JOIN county '
+                         'ON county.id = D.county_id')
+
+    @cached_query('land', 'owner', 'county', 'district')
+    def get_land_cube(self, *dimensions):
+        # Rolls land_cube up to the given dimensions, all of them omitted for
+        # one statewide row. Population and growth rate are per county, so the
+        # cells are first summed per county and joined to county there.
+        for dimension in dimensions:
+            if dimension not in CUBE_DIMENSIONS:
+                raise ValueError('Cube dimension must be one of ' + ', '.join(CUBE_DIMENSIONS))
+        self.refresh_cube()
+
+        # Population comes from district.csv when it is loaded with a
+        # crosswalk, otherwise from county.pop.
+        population, districts = 'C.pop', ''
+        if self.district_counties is not None:
+            population = 'coalesce(P.population, C.pop)'
+            districts = ' LEFT JOIN district_population P ON P.county_id = K.county_id'
+
+        columns = [CUBE_DIMENSIONS[dimension] for dimension in dict.fromkeys(dimensions)]
+        cells = columns + ([] if 'county_id' in columns else ['county_id'])
+        group = ', '.join('K.' + column for column in columns)
+        self.cur.execute('SELECT ' + ''.join('K.' + column + ', ' for column in columns) +
+                         'SUM(K.land_count) AS parcel_count, '
+                         'SUM(K.area_sum) AS total_area, '
+                         'SUM(K.rating_sum) * 1.0 / SUM(K.land_count) AS average_rating, '
+                         'SUM(' + population + ') AS population, '
+                         'SUM(C.growth_rate * ' + population + ') / SUM(' + population + ') AS growth_rate '
+                         'FROM (SELECT ' + ', '.join(cells) + ', '
+                         'SUM(land_count) AS land_count, SUM(rating_sum) AS rating_sum, SUM(area_sum) AS area_sum '
+                         'FROM land_cube '
+                         'GROUP BY ' + ', '.join(cells) + ') K '
+                         'LEFT JOIN county C '
+                         'ON C.id = K.county_id' + districts +
+                         (' GROUP BY ' + group + ' ORDER BY ' + group if columns else ''))
+
+    def refresh_cube(self):
+        self.cur.execute('SELECT 1 FROM land_cube_dirty LIMIT 1')
+        if self.cur.fetchone() is not None:
+            for statement in CUBE_REFRESH:
+                self.cur.execute(statement)
+
+        if self.district_counties is not None and self.district_population_version != self.generations['district']:
+            county_ids, population = self.districts.aggregate('pop', self.district_counties)
+            self.cur.execute('CREATE TEMP TABLE IF NOT EXISTS district_population '
+                             '(county_id INTEGER NOT NULL PRIMARY KEY, '
+                             'population FLOAT)')
+            self.cur.execute('DELETE FROM district_population')
+            self.cur.executemany('INSERT INTO district_population (county_id, population) VALUES (?, ?)',
+                                 zip(county_ids.tolist(), population.tolist()))
+            self.district_population_version = self.generations['district']
+
+    def plan_improvements(self, budget, method='knapsack', objective='rating', county_id=None, max_rating=None):
+        # Ranks the parcel improvements that raise ratings most for budget,
+        # one improvement per parcel. Costs are per unit of area. Only parcels
+        # in county_id and rated at most max_rating are considered, if given.
+        from final_project.TEAL import planner
+
+        start = time.perf_counter()
+        land = planner.land_arrays(self.plan_land(county_id, max_rating))
+        improvements = planner.improvement_arrays(self.plan_options())
+        plan = planner.plan(land, improvements, budget, method, objective, MAX_RATING)
+        rows = plan.rows(land, improvements, MAX_RATING)
+        self.result_rows = rows
+        sys.stdout.write('Planned %d improvements costing %.2f of %.2f for a %s gain of %.1f in %.3fs\n'
+                         % (len(plan), plan.total_cost(), plan.budget, objective, plan.total_gain(),
+                            time.perf_counter() - start))
+        return rows
+
+    def plan_land(self, county_id=None, max_rating=None):
+        self.materialize('land')
+        self.cur.execute('SELECT id, county_id, rating, area '
+                         'FROM land '
+                         'WHERE rating IS NOT NULL AND area IS NOT NULL '
+                         'AND ((? IS NULL) OR (county_id = ?)) '
+                         'AND ((? IS NULL) OR (rating <= ?))',
+                         (county_id, county_id, max_rating, max_rating))
+        return self.cur.fetchall()
+
+    def plan_options(self):
+        self.materialize('improvement')
+        self.cur.execute('SELECT id, improvement_type, cost, improvement '
+                         'FROM improvement '
+                         'WHERE cost IS NOT NULL AND improvement IS NOT NULL')
+        return self.cur.fetchall()
+
+    def build_land_index(self, column, index_path):
+        # The B+tree is a snapshot of land ordered on (column, id); it is not
+        # updated by later inserts or deletes and is rebuilt by calling this again.
+        if column not in TABLE_COLUMNS['land']:
+            raise ValueError('No such column in land: ' + column)
+
+        self.materialize('land')
+        index_path = Path(index_path)
+        if index_path.is_file():
+            index_path.unlink()
+        start = time.perf_counter()
+        tree = btree.BPlusTree(index_path)
+        reader = self.cursor()
+        reader.execute('SELECT ' + column + ', id FROM land WHERE ' + column + ' IS NOT NULL '
+                       'ORDER BY ' + column + ', id')
+        tree.bulk_load(reader)
+        sys.stdout.write('Built %s index on land(%s) with %d entries in %.3fs\n'
+                         % (index_path.name, column, len(tree), time.perf_counter() - start))
+        return tree
+
+    def export(self, source, output_dir, partition_by='county_id', file_format='csv.gz', workers=None,
+               buckets=None):
+        from final_project.TEAL import export
+
+        # Partitions are read on their own connections, which only see committed rows.
+        self.materialize(*EXPORT_TABLES)
+        self.commit()
+        manifest = export.export(self.db_file, source, output_dir, partition_by, file_format, workers, buckets)
+        sys.stdout.write('Exported %d rows of %s into %d %s partitions in %.3fs\n'
+                         % (manifest['rows'], source, len(manifest['partitions']), file_format, manifest['seconds']))
+        return manifest
+
+    def insert_into_land(self, land_id, owner_id, county_id, rating, area, bounds=None):
+        row = (int(land_id), int(owner_id), int(county_id), int(rating), int(area))
+        box = None if bounds is None else land_box(land_id, *bounds)
+        self.materialize('land')
+        # The row and its box go in under one savepoint, so a failed box
+        # leaves no parcel behind. It nests in whatever transaction group
+        # commit or transaction() holds open.
+        if not self.conn.in_transaction:
+            self.cur.execute('BEGIN')
+        self.cur.execute('SAVEPOINT teal_insert_land')
+        try:
+            self.cur.execute('INSERT INTO land (id, owner_id, county_id, rating, area) '
+                             'VALUES (?, ?, ?, ?, ?)', row)
+            if box is not None:
+                self.cur.execute(GEOMETRY_INSERT, box)
+        except Exception:
+            self.cur.execute('ROLLBACK TO teal_insert_land')
+            raise
+        finally:
+            self.cur.execute('RELEASE teal_insert_land')
+            self.touch('land')
+
+    def insert_land_geometry(self, land_id, min_x, max_x, min_y, max_y):
+        box = land_box(land_id, min_x, max_x, min_y, max_y)
+        self.materialize('land')
+        self.cur.execute('SELECT 1 FROM land WHERE id = ?', (box[0],))
+        if self.cur.fetchone() is None:
+            raise ValueError('No such land: ' + str(land_id))
+        self.cur.execute(GEOMETRY_INSERT, box)
+        self.touch('land')
 
     def insert_into_county(self, county_id, county_name, pop, growth_rate):
+        self.materialize('county')
         self.cur.execute('INSERT INTO county (id, name, pop, growth_rate) '
                          'VALUES (?, ?, ?, ?)',
                          (int(county_id), county_name, int(pop), float(growth_rate)))
+        self.touch('county')
 
     def insert_into_improvement(self, improvement_id, improvement_type, cost, improvement):
+        self.materialize('improvement')
         self.cur.execute('INSERT INTO improvement (id, improvement_type, cost, improvement) '
                          'VALUES (?, ?, ?, ?)',
                          (int(improvement_id), improvement_type, float(cost), int(improvement)))
+        self.touch('improvement')
 
     def insert_into_owner(self, owner_id, status, name):
+        self.materialize('owner')
         self.cur.execute('INSERT INTO owner (id, status, name)'
                          'VALUES (?, ?, ?)',
                          (int(owner_id), status, name))
+        self.touch('owner')
 
-    def write_csv(self, csv_path):
-        with csv_path.open('w') as csv_file:
+    def write_csv(self, csv_path, batch_size=RESULT_BATCH_SIZE):
+        with csv_path.open('w', buffering=WRITE_BUFFER_SIZE) as csv_file:
             csv_writer = csv.writer(csv_file, delimiter=',')
-            row = self.cur.fetchone()
-            while row is not None:
-                csv_writer.writerow(row)
-                row = self.cur.fetchone()
+            for batch in self.iter_batches(batch_size):
+                csv_writer.writerows(batch)
+
+    def iter_batches(self, batch_size=RESULT_BATCH_SIZE):
+        rows = self.result_rows
+        if rows is not None:
+            self.result_rows = None
+            for start in range(0, len(rows), batch_size):
+                yield rows[start:start + batch_size]
+            return
+
+        batch = self.cur.fetchmany(batch_size)
+        while batch:
+            yield batch
+            batch = self.cur.fetchmany(batch_size)
+
+    def iter_rows(self, batch_size=RESULT_BATCH_SIZE):
+        for batch in self.iter_batches(batch_size):
+            yield from batch
 
+    def get_page(self, table_name, page=1, page_size=RESULT_BATCH_SIZE, key='id', after=None):
+        self.materialize(table_name)
+        self.cur.execute('PRAGMA table_info(' + index_advisor.quote_identifier(table_name) + ')')
+        # NULL never compares in a row value, so only keys that cannot be
+        # NULL page correctly: NOT NULL columns and the INTEGER PRIMARY KEY.
+        not_null = {row[1].lower(): row[3] or (row[5] == 1 and row[2].upper() == 'INTEGER')
+                    for row in self.cur.fetchall()}
+        if key.lower() not in not_null:
+            raise ValueError('Cannot page ' + table_name + ' on unknown column ' + key)
+        if not not_null[key.lower()]:
+            raise ValueError('Cannot page ' + table_name + ' on nullable column ' + key)
+
+        # Rows are ordered on (key, rowid) so a non-unique key still gives a
+        # stable keyset; `after` is the (key, rowid) pair that ended the last
+        # page. Page N without a cursor seeks its first (key, rowid) once,
+        # reading only the key index rather than whole rows.
+        if after is None and page > 1:
+            self.cur.execute('SELECT ' + key + ', rowid FROM ' + table_name + ' '
+                             'ORDER BY ' + key + ', rowid LIMIT 1 OFFSET ?',
+                             ((page - 1) * page_size,))
+            start = self.cur.fetchone()
+            if start is None:
+                return [], None
+            where, params = '(' + key + ', rowid) >= (?, ?)', start
+        elif after is not None:
+            where, params = '(' + key + ', rowid) > (?, ?)', tuple(after)
+        else:
+            where, params = '1', ()
+
+        self.cur.execute('SELECT ' + key + ', rowid, * FROM ' + table_name + ' '
+                         'WHERE ' + where + ' '
+                         'ORDER BY ' + key + ', rowid LIMIT ?',
+                         tuple(params) + (page_size,))
+        rows = self.cur.fetchall()
+        if not rows:
+            return [], None
+        next_after = (rows[-1][0], rows[-1][1]) if len(rows) == page_size else None
+        return [row[2:] for row in rows], next_after
+
+    @cached_query('land', 'county')
     def get_land_by_county(self, county_id, county_name):
+        # The name is resolved to ids through the name index first, so land is
+        # searched on county_id instead of scanned for a matching name.
+        county_ids = [] if county_name is None else self.name_ids('county', county_name)
+        if county_id is not None:
+            county_ids.append(county_id)
+        where = predicate.In('L.county_id', county_ids) if county_ids else None
         self.cur.execute('SELECT L.*, C.* '
                          'FROM land L '
                          'INNER JOIN county C '
                          'ON C.id = L.county_id '
-                         'WHERE L.county_id = ? '
-                         'OR C.name = ?', (county_id, county_name))
+                         'WHERE ' + ('0' if where is None else where.sql()),
+                         [] if where is None else where.params())
 
+    @cached_query('land')
     def get_land_by_area(self, min_area, max_area):
         self.cur.execute('SELECT * '
                          'FROM land '
@@ -145,15 +1172,83 @@ class Database:
                          'AND ((? IS NULL) OR (area <= ?))',
                          (min_area, min_area, max_area, max_area))
 
+    @cached_query('land')
+    def get_land_in_box(self, min_x, max_x, min_y, max_y):
+        self.cur.execute('SELECT L.*, G.min_x, G.max_x, G.min_y, G.max_y '
+                         'FROM land_geometry G '
+                         'INNER JOIN land L '
+                         'ON L.id = G.id '
+                         'WHERE G.max_x >= ? AND G.min_x <= ? '
+                         'AND G.max_y >= ? AND G.min_y <= ?',
+                         (min_x, max_x, min_y, max_y))
+
+    def get_land_at_point(self, x, y):
+        return self.get_land_in_box(x, x, y, y)
+
+    @cached_query('land')
+    def get_nearest_land(self, x, y, k=1):
+        # Probe the R*Tree with a box around (x, y), widening it until it holds
+        # k parcels that are no farther away than the box's half-width. Every
+        # parcel within that distance intersects the box, so the answer is exact.
+        query = ('SELECT L.*, G.min_x, G.max_x, G.min_y, G.max_y, sqrt(' + BOX_DISTANCE + ') AS distance '
+                 'FROM land_geometry G '
+                 'INNER JOIN land L '
+                 'ON L.id = G.id ')
+        k = max(int(k), 0)
+        probe = self.cursor()
+        # Counted through the join, like the answer, so boxes without a land row are not waited for.
+        available = probe.execute('SELECT count(*) FROM (SELECT 1 FROM land_geometry G '
+                                  'INNER JOIN land L ON L.id = G.id LIMIT ?)', (k,)).fetchone()[0]
+        if k == 0 or available < k:
+            self.cur.execute(query + 'ORDER BY distance LIMIT :k', {'x': x, 'y': y, 'k': k})
+            return
+        min_x, max_x, min_y, max_y = self.geometry_extent()
+
+        # Seed the radius from the size of, and distance to, an arbitrary parcel.
+        seed = probe.execute('SELECT min_x, max_x, min_y, max_y, sqrt(' + BOX_DISTANCE + ') '
+                             'FROM land_geometry G LIMIT 1', {'x': x, 'y': y}).fetchone()
+        radius = max(seed[1] - seed[0], seed[3] - seed[2], seed[4] / 1024, 1e-9)
+        while True:
+            params = {'x': x, 'y': y, 'k': k, 'min_x': x - radius, 'max_x': x + radius,
+                      'min_y': y - radius, 'max_y': y + radius}
+            box_query = (query + 'WHERE G.max_x >= :min_x AND G.min_x <= :max_x '
+                                 'AND G.max_y >= :min_y AND G.min_y <= :max_y '
+                                 'ORDER BY distance LIMIT :k')
+            rows = probe.execute(box_query, params).fetchall()
+            if len(rows) == k and rows[-1][-1] <= radius:
+                self.cur.execute(box_query, params)
+                return
+            if params['min_x'] <= min_x and params['max_x'] >= max_x and params['min_y'] <= min_y and \
+                    params['max_y'] >= max_y:
+                # The box already holds every parcel, so widening cannot change the answer.
+                self.cur.execute(query + 'ORDER BY distance LIMIT :k', params)
+                return
+            radius *= 4
+
+    def geometry_extent(self):
+        # Bounds of every box in land_geometry, recomputed after land changes.
+        if self.extent is None or self.extent[0] != self.generations['land']:
+            extent = self.cursor().execute('SELECT min(min_x), max(max_x), min(min_y), max(max_y) '
+                                           'FROM land_geometry').fetchone()
+            self.extent = (self.generations['land'], extent)
+        return self.extent[1]
+
+    @cached_query('land', 'owner')
     def get_land_by_owner(self, owner_id, owner_name):
+        name_match, params = '1', []
+        if owner_name is not None:
+            owner_ids = self.name_ids('owner', owner_name)
+            where = predicate.In('land.owner_id', owner_ids) if owner_ids else None
+            name_match, params = ('0', []) if where is None else (where.sql(), where.params())
         self.cur.execute('SELECT * '
                          'FROM land '
                          'INNER JOIN owner '
                          'ON owner.id = land.owner_id '
                          'WHERE((? IS NULL) OR (? = land.owner_id)) '
-                         'AND ((? IS NULL) OR (? = owner.name))',
-                         (owner_id, owner_id, owner_name, owner_name))
+                         'AND ' + name_match,
+                         [owner_id, owner_id] + params)
 
+    @cached_query('land')
     def get_land_by_quality_rating(self, min_rating, max_rating):
         self.cur.execute('SELECT * '
                          'FROM land '
@@ -161,6 +1256,7 @@ class Database:
                          'AND ((? IS NULL) OR (rating <= ?))',
                          (min_rating, min_rating, max_rating, max_rating))
 
+    @cached_query('land', 'owner', 'county')
     def view_land_details(self):
         self.cur.execute('SELECT L.*, '
                          'O.name AS owner_name, '
@@ -174,64 +1270,68 @@ class Database:
                          'INNER JOIN county C '
                          'ON C.id = L.owner_id')
 
+    @cached_query('land', 'county')
     def get_average_rating_county(self):
-        self.cur.execute('SELECT county.id, county.name, AVG(land.rating) '
-                         'FROM county '
-                         'INNER JOIN land '
-                         'ON land.county_id = county.id '
-                         'GROUP BY county.id, county.name')
+        self.cur.execute('SELECT county.id, county.name, R.rating_sum * 1.0 / nullif(R.rating_count, 0) '
+                         'FROM county_rollup R '
+                         'INNER JOIN county '
+                         'ON county.id = R.county_id')
 
+    @cached_query('land', 'owner')
     def get_area_by_owner(self):
-        self.cur.execute('SELECT owner.id, owner.name, SUM(land.area) as owned_area '
-                         'FROM owner '
-                         'INNER JOIN land '
-                         'ON land.owner_id = owner.id '
-                         'GROUP BY owner.id, owner.name'
-                         )
+        self.cur.execute('SELECT owner.id, owner.name, '
+                         'CASE WHEN R.area_count > 0 THEN R.area_sum END as owned_area '
+                         'FROM owner_rollup R '
+                         'INNER JOIN owner '
+                         'ON owner.id = R.owner_id')
 
+    @cached_query('land', 'owner', 'county')
     def get_owners_in_county(self, county_id, county_name):
+        # Leaving either argument empty matches every county.
+        where, params = '1', []
+        if county_id is not None and county_name is not None:
+            county_in = predicate.In('R.county_id', [county_id] + self.name_ids('county', county_name))
+            where, params = county_in.sql(), county_in.params()
         self.cur.execute('SELECT owner.id owner_id, owner.name owner_name, '
-                         'SUM(land.area), '
+                         'CASE WHEN R.area_count > 0 THEN R.area_sum END, '
                          'county.id county_id, county.name county_name '
-                         'FROM owner '
-                         'INNER JOIN land '
-                         'ON owner.id = land.owner_id '
+                         'FROM owner_county_rollup R '
+                         'INNER JOIN owner '
+                         'ON owner.id = R.owner_id '
                          'INNER JOIN county '
-                         'ON county.id = land.county_id '
-                         'WHERE((? IS NULL) OR (land.county_id = ?)) '
-                         'OR ((? IS NULL) OR (county.name = ?))'
-                         'GROUP BY owner.id, owner.name, county.id, county.name',
-                         (county_id, county_id, county_name, county_name))
+                         'ON county.id = R.county_id '
+                         'WHERE ' + where,
+                         params)
 
+    @cached_query('land', 'county')
     def get_critical_land_count_by_county(self, critical_threshold):
-        self.cur.execute('SELECT county.id, county.name, COUNT(land.id) as critical_count '
-                         'FROM county '
-                         'INNER JOIN land '
-                         'ON county.id = land.county_id '
-                         'WHERE land.rating <= ? '
+        self.cur.execute('SELECT county.id, county.name, SUM(R.land_count) as critical_count '
+                         'FROM county_rating_rollup R '
+                         'INNER JOIN county '
+                         'ON county.id = R.county_id '
+                         'WHERE R.rating <= ? '
                          'GROUP BY county.id, county.name ',
-                         critical_threshold)
+                         (critical_threshold,))
 
+    @cached_query('land', 'owner')
     def get_land_by_status(self, land_status):
         self.cur.execute('SELECT * '
                          'FROM land '
                          'INNER JOIN owner '
                          'ON owner.id = land.owner_id '
                          'WHERE owner.status = ?',
-                         (land_status))
+                         (land_status,))
 
     def generic_query(self, table, distinct, compare_val, condition):
-        query = "SELECT "
-        if distinct:
-            query += "DISTINCT "
-        query += "* FROM " + table
-        if compare_val is not None:
-            query += " WHERE " + compare_val + condition
+        where = None
+        if compare_val:
+            where = predicate.parse_condition(compare_val.strip(), condition)
+        return self.select(table.strip(), where, distinct)
 
-        self.cur.execute(query)
+    def write_result(self, batch_size=RESULT_BATCH_SIZE):
+        for batch in self.iter_batches(batch_size):
+            sys.stdout.write('\n'.join(map(str, batch)) + '\n')
 
-    def write_result(self):
-        row = self.cur.fetchone()
-        while row is not None:
-            print(row)
-            row = self.cur.fetchone()
+
+for name in PROFILED_METHODS:
+    setattr(Database, name, profiler.profiled(getattr(Database, name)))
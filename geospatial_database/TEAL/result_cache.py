@@ -0,0 +1,69 @@
+import sys
+import threading
+from collections import OrderedDict
+
+CACHE_MAX_ENTRIES = 256
+
+CACHE_MAX_BYTES = 64 << 20
+
+# Sizing every row of a large result would cost as much as the query, so
+# the size is extrapolated from a sample of rows.
+SIZE_SAMPLE_ROWS = 64
+
+
+def estimate_size(rows):
+    size = sys.getsizeof(rows)
+    if not rows:
+        return size
+    step = max(1, len(rows) // SIZE_SAMPLE_ROWS)
+    sample = rows[::step]
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample)
+    return size + sample_size * len(rows) // len(sample)
+
+
+class ResultCache:
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, generations):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            tables, seen, rows, size = entry
+            if any(generations[table] != generation for table, generation in zip(tables, seen)):
+                # A table this result reads has been written since it was cached.
+                del self.entries[key]
+                self.size -= size
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return rows
+
+    def put(self, key, tables, generations, rows):
+        size = estimate_size(rows)
+        if size > self.max_bytes:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[3]
+            self.entries[key] = (tables, tuple(generations[table] for table in tables), rows, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.size -= self.entries.popitem(last=False)[1][3]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
@@ -0,0 +1,390 @@
+import csv
+import inspect
+import json
+import multiprocessing
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from pathlib import Path
+from final_project.TEAL import queries, predicate
+
+DEFAULT_SHARDS = 4
+
+# Parcels moved between shards per statement when a modify changes county_id.
+MOVE_BATCH_SIZE = 500
+
+MANIFEST_NAME = 'shards.json'
+
+# Copied whole into every shard; land is split between them on county_id.
+REPLICATED_TABLES = ('county', 'owner', 'improvement')
+
+# Databases opened by this worker process, one per shard file.
+open_shards = {}
+
+
+def shard_database(shard_file):
+    database = open_shards.get(shard_file)
+    if database is None:
+        # persistent, so a worker never drops the tables the router created.
+        database = open_shards[shard_file] = queries.Database(shard_file, persistent=True)
+    return database
+
+
+def read_rows(database, method_name, args):
+    rows = getattr(database, method_name)(*args)
+    if rows is None:
+        rows = database.cur.fetchall()
+    return rows
+
+
+def read_shard(shard_file, method_name, args):
+    return read_rows(shard_database(shard_file), method_name, args)
+
+
+def load_shard(shard_file, table_name, csv_path):
+    return shard_database(shard_file).load_table(table_name, Path(csv_path))
+
+
+def concat(partials, args):
+    return [row for rows in partials for row in rows]
+
+
+def sum_last(partials, args):
+    # Rows whose last column is a per-shard sum of the group in the others.
+    totals = {}
+    for rows in partials:
+        for row in rows:
+            totals[row[:-1]] = totals.get(row[:-1], 0) + (row[-1] or 0)
+    return [key + (total,) for key, total in totals.items()]
+
+
+def nearest(partials, args):
+    # Each shard returns its own k nearest with the distance last.
+    k = args[2] if len(args) > 2 else 1
+    return sorted(concat(partials, args), key=lambda row: row[-1])[:k]
+
+
+# Statewide reads, fanned out to every shard, and how their results combine.
+FAN_OUT_METHODS = {'get_land_by_area': concat,
+                   'get_land_by_owner': concat,
+                   'get_land_by_quality_rating': concat,
+                   'view_land_details': concat,
+                   'get_average_rating_county': concat,
+                   'get_area_by_owner': sum_last,
+                   'get_critical_land_count_by_county': concat,
+                   'get_land_by_status': concat,
+                   'get_land_in_box': concat,
+                   'get_land_at_point': concat,
+                   'get_nearest_land': nearest}
+
+
+class ShardedDatabase:
+    # Routes Database calls over shard files next to database_file. Writes go
+    # through this process's connection to each shard; statewide reads run on
+    # every shard at once in a process pool and the partial results are merged.
+    def __init__(self, database_file, persistent=False, shard_count=DEFAULT_SHARDS, workers=None):
+        database_file = Path(database_file)
+        self.directory = database_file.with_name(database_file.stem + '_shards')
+        self.directory.mkdir(parents=True, exist_ok=True)
+        manifest_path = self.directory / MANIFEST_NAME
+        if persistent and manifest_path.is_file():
+            with manifest_path.open('r') as manifest_file:
+                recorded = json.load(manifest_file)['shards']
+            if recorded != shard_count:
+                raise ValueError('%s holds %d shards, not %d' % (self.directory, recorded, shard_count))
+        with manifest_path.open('w') as manifest_file:
+            json.dump({'shards': shard_count, 'key': 'county_id'}, manifest_file)
+
+        self.persistent = persistent
+        self.shard_files = [str(self.directory / ('shard_%d.sqlite' % index)) for index in range(shard_count)]
+        self.shards = [queries.Database(shard_file, persistent) for shard_file in self.shard_files]
+        self.workers = workers or shard_count
+        self.executor = None
+        self.result_rows = None
+        self.profiler = None
+
+    def pool(self):
+        if self.executor is None:
+            # Spawned rather than forked, so no worker inherits an open SQLite connection.
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self.executor
+
+    def shard_index(self, county_id):
+        return int(county_id) % len(self.shards)
+
+    def county_shards(self, county_id, county_name):
+        indexes = set()
+        if county_id is not None:
+            indexes.add(self.shard_index(county_id))
+        if county_name is not None:
+            indexes.update(self.shard_index(county) for county in self.shards[0].name_ids('county', county_name))
+        return sorted(indexes)
+
+    def read(self, method_name, args, merge=concat, indexes=None):
+        indexes = range(len(self.shards)) if indexes is None else indexes
+        if len(indexes) == 1:
+            partials = [read_rows(self.shards[indexes[0]], method_name, args)]
+        else:
+            # Workers read on their own connections, which only see committed rows.
+            self.commit()
+            partials = list(self.pool().map(read_shard, [self.shard_files[index] for index in indexes],
+                                            repeat(method_name), repeat(args)))
+        self.result_rows = merge(partials, args)
+        return self.result_rows
+
+    def write(self, method_name, *args, indexes=None):
+        indexes = range(len(self.shards)) if indexes is None else indexes
+        return [getattr(self.shards[index], method_name)(*args) for index in indexes]
+
+    def load_table(self, table_name, csv_path):
+        if table_name in REPLICATED_TABLES:
+            tasks = [(shard_file, csv_path) for shard_file in self.shard_files]
+        else:
+            tasks = list(zip(self.shard_files, self.split_land(csv_path)))
+        # Shards are separate files, so each is bulk loaded by its own process.
+        self.commit()
+        row_counts = list(self.pool().map(load_shard, [shard_file for shard_file, _ in tasks], repeat(table_name),
+                                          [str(path) for _, path in tasks]))
+        for shard in self.shards:
+            shard.touch(table_name)
+        return row_counts[0] if table_name in REPLICATED_TABLES else sum(row_counts)
+
+    def split_land(self, csv_path):
+        paths = [self.directory / ('land_%d.csv' % index) for index in range(len(self.shards))]
+        outputs = [path.open('w', newline='', buffering=queries.WRITE_BUFFER_SIZE) for path in paths]
+        try:
+            writers = [csv.writer(output) for output in outputs]
+            with csv_path.open('r') as csv_file:
+                read_csv = csv.reader(csv_file)
+                header = next(read_csv, None)
+                for writer in writers:
+                    writer.writerow(header or queries.TABLE_COLUMNS['land'])
+                for row in read_csv:
+                    if row:
+                        # Rows without a usable county_id stay together on shard 0.
+                        index = self.shard_index(row[2]) if len(row) > 2 and row[2].strip().isdigit() else 0
+                        writers[index].writerow(row)
+        finally:
+            for output in outputs:
+                output.close()
+        return paths
+
+    def load_land_data(self, land_csv):
+        return self.load_table('land', land_csv)
+
+    def load_county_data(self, county_csv):
+        return self.load_table('county', county_csv)
+
+    def load_improvement_data(self, improve_csv):
+        return self.load_table('improvement', improve_csv)
+
+    def load_owner_data(self, owner_csv):
+        return self.load_table('owner', owner_csv)
+
+    def get_land_by_county(self, county_id, county_name):
+        return self.read('get_land_by_county', (county_id, county_name),
+                         indexes=self.county_shards(county_id, county_name))
+
+    def get_owners_in_county(self, county_id, county_name):
+        # Either argument left empty matches every county, as in Database.
+        indexes = None
+        if county_id is not None and county_name is not None:
+            indexes = self.county_shards(county_id, county_name)
+        return self.read('get_owners_in_county', (county_id, county_name), indexes=indexes)
+
+    def generic_query(self, table, distinct, compare_val, condition):
+        args = (table, distinct, compare_val, condition)
+        if table.strip() != 'land':
+            return self.read('generic_query', args, indexes=[0])
+        rows = self.read('generic_query', args)
+        if distinct:
+            self.result_rows = rows = list(dict.fromkeys(rows))
+        return rows
+
+    def search_names(self, table_name, text, mode='prefix', limit=queries.NAME_SEARCH_LIMIT):
+        return self.read('search_names', (table_name, text, mode, limit), indexes=[0])
+
+    def get_land_cube(self, *dimensions):
+        # A county's parcels all live on one shard, so per-county cells from
+        # every shard roll up here exactly as Database rolls up its own cube.
+        dimensions = list(dict.fromkeys(dimensions))
+        by_county = ['county'] + [dimension for dimension in dimensions if dimension != 'county']
+        # Regrouped here first, so the workers only read.
+        self.write('refresh_cube')
+        cells = self.read('get_land_cube', tuple(by_county))
+        positions = [by_county.index(dimension) for dimension in dimensions]
+        groups = {}
+        for cell in cells:
+            count, area, rating, population, growth_rate = cell[len(by_county):]
+            group = groups.setdefault(tuple(cell[position] for position in positions), [0, 0, 0.0, None, None])
+            group[0] += count
+            group[1] += area
+            group[2] += rating * count
+            if population is not None:
+                group[3] = (group[3] or 0) + population
+                if growth_rate is not None:
+                    group[4] = (group[4] or 0) + growth_rate * population
+        self.result_rows = [key + (count, area, rating / count, population,
+                                   None if weighted is None or not population else weighted / population)
+                            for key, (count, area, rating, population, weighted)
+                            in sorted(groups.items(), key=lambda item: [(value is not None, value)
+                                                                        for value in item[0]])]
+        return self.result_rows
+
+    def plan_improvements(self, budget, method='knapsack', objective='rating', county_id=None, max_rating=None):
+        # The budget is shared statewide, so parcels from every shard are
+        # planned together here.
+        from final_project.TEAL import planner
+
+        indexes = None if county_id is None else [self.shard_index(county_id)]
+        land = planner.land_arrays(self.read('plan_land', (county_id, max_rating), indexes=indexes))
+        improvements = planner.improvement_arrays(self.shards[0].plan_options())
+        plan = planner.plan(land, improvements, budget, method, objective, queries.MAX_RATING)
+        self.result_rows = plan.rows(land, improvements, queries.MAX_RATING)
+        return self.result_rows
+
+    def insert_into_land(self, land_id, owner_id, county_id, rating, area, bounds=None):
+        self.shards[self.shard_index(county_id)].insert_into_land(land_id, owner_id, county_id, rating, area,
+                                                                   bounds)
+
+    def insert_land_geometry(self, land_id, min_x, max_x, min_y, max_y):
+        for shard in self.shards:
+            shard.cur.execute('SELECT 1 FROM land WHERE id = ?', (int(land_id),))
+            if shard.cur.fetchone() is not None:
+                shard.insert_land_geometry(land_id, min_x, max_x, min_y, max_y)
+                return
+        raise ValueError('No such land: ' + str(land_id))
+
+    def insert_into_county(self, county_id, county_name, pop, growth_rate):
+        self.write('insert_into_county', county_id, county_name, pop, growth_rate)
+
+    def insert_into_improvement(self, improvement_id, improvement_type, cost, improvement):
+        self.write('insert_into_improvement', improvement_id, improvement_type, cost, improvement)
+
+    def insert_into_owner(self, owner_id, status, name):
+        self.write('insert_into_owner', owner_id, status, name)
+
+    def delete_table(self, table_name):
+        self.write('delete_table', table_name)
+
+    def delete_item(self, table_name, col, condition):
+        self.write('delete_item', table_name, col, condition)
+
+    def delete_by_name(self, table_name, name):
+        return self.write('delete_by_name', table_name, name)[0]
+
+    def modify_item(self, table_name, col, condition, assignments):
+        county = [value for name, value in assignments.items() if name.lower() == 'county_id']
+        if table_name != 'land' or not county:
+            return sum(self.write('modify_item', table_name, col, condition, assignments))
+
+        # Parcels given a county on another shard move there. The ids are
+        # taken before the update, which may stop them matching condition.
+        where = predicate.parse_condition(col.strip(), condition)
+        matched = [[row[0] for row in shard.cur.execute('SELECT id FROM ' + shard.checked_table('land', where) +
+                                                        ' WHERE ' + where.sql(), where.params()).fetchall()]
+                   for shard in self.shards]
+        modified = sum(self.write('modify_item', table_name, col, condition, assignments))
+        # Rows without a usable county_id stay on shard 0, as when loaded.
+        target = 0 if county[0] is None else self.shard_index(county[0])
+        for index, ids in enumerate(matched):
+            if index == target:
+                continue
+            for start in range(0, len(ids), MOVE_BATCH_SIZE):
+                self.move_land(ids[start:start + MOVE_BATCH_SIZE], self.shards[index], self.shards[target])
+        return modified
+
+    def move_land(self, ids, source, target):
+        # The copy is committed on the target before the source deletes its
+        # rows, so a failure in between leaves a parcel twice, never nowhere.
+        # The delete trigger clears the old boxes.
+        columns = ', '.join(queries.TABLE_COLUMNS['land'])
+        where = predicate.In('id', ids)
+        rows = source.cur.execute('SELECT ' + columns + ' FROM land WHERE ' + where.sql(), where.params()).fetchall()
+        boxes = source.cur.execute('SELECT id, min_x, max_x, min_y, max_y FROM land_geometry '
+                                   'WHERE ' + where.sql(), where.params()).fetchall()
+        target.cur.executemany('INSERT INTO land (' + columns + ') '
+                               'VALUES (' + ', '.join('?' * len(queries.TABLE_COLUMNS['land'])) + ')', rows)
+        target.cur.executemany(queries.GEOMETRY_INSERT, boxes)
+        target.touch('land')
+        target.commit()
+        source.cur.execute('DELETE FROM land WHERE ' + where.sql(), where.params())
+        source.touch('land')
+        source.commit()
+
+    def apply_improvement(self, improvement_id, max_rating, county_id=None):
+        indexes = None if county_id is None else [self.shard_index(county_id)]
+        return sum(self.write('apply_improvement', improvement_id, max_rating, county_id, indexes=indexes))
+
+    def reassign_owner(self, from_owner_id, to_owner_id):
+        return sum(self.write('reassign_owner', from_owner_id, to_owner_id))
+
+    def export(self, source, output_dir, partition_by='county_id', file_format='csv.gz', workers=None,
+               buckets=None):
+        # Every export source is land joined to replicated tables, so each
+        # shard exports its own parcels into a shard_<n> directory.
+        from final_project.TEAL import export
+
+        self.commit()
+        start = time.perf_counter()
+        manifests = [export.export(shard_file, source, Path(output_dir) / ('shard_%d' % index), partition_by,
+                                   file_format, workers, buckets)
+                     for index, shard_file in enumerate(self.shard_files)]
+        sys.stdout.write('Exported %d rows of %s from %d shards into %d %s partitions in %.3fs\n'
+                         % (sum(manifest['rows'] for manifest in manifests), source, len(manifests),
+                            sum(len(manifest['partitions']) for manifest in manifests), file_format,
+                            time.perf_counter() - start))
+        return manifests
+
+    def get_page(self, *args, **kwargs):
+        raise ValueError('Keyset paging is not supported on a sharded database')
+
+    def transaction(self):
+        raise ValueError('Transactions cannot span the files of a sharded database')
+
+    def iter_batches(self, batch_size=queries.RESULT_BATCH_SIZE):
+        rows, self.result_rows = self.result_rows or [], None
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def write_result(self, batch_size=queries.RESULT_BATCH_SIZE):
+        for batch in self.iter_batches(batch_size):
+            sys.stdout.write('\n'.join(map(str, batch)) + '\n')
+
+    def write_csv(self, csv_path, batch_size=queries.RESULT_BATCH_SIZE):
+        with csv_path.open('w', buffering=queries.WRITE_BUFFER_SIZE) as csv_file:
+            csv_writer = csv.writer(csv_file, delimiter=',')
+            for batch in self.iter_batches(batch_size):
+                csv_writer.writerows(batch)
+
+    def commit(self):
+        for shard in self.shards:
+            shard.commit()
+
+    def flush(self):
+        for shard in self.shards:
+            shard.flush()
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+        for shard in self.shards:
+            shard.close()
+
+
+def fan_out(method_name, merge):
+    # Shards are called positionally, so keyword arguments are bound to
+    # their places first.
+    signature = inspect.signature(getattr(queries.Database, method_name))
+
+    def read(self, *args, **kwargs):
+        bound = signature.bind(self, *args, **kwargs)
+        bound.apply_defaults()
+        return self.read(method_name, bound.args[1:], merge)
+    read.__name__ = method_name
+    return read
+
+
+for name, merge in FAN_OUT_METHODS.items():
+    setattr(ShardedDatabase, name, fan_out(name, merge))
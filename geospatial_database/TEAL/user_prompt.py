@@ -3,7 +3,7 @@ from final_project import util
 from final_project.TEAL import queries, input_prompt, modify_prompt, delete_prompt, query_prompt
 
 
-def user_prompt():
+def user_prompt(profile=None, in_memory=False, snapshot_seconds=None, shards=None):
     sys.stdout.write("Welcome to TEAL (Texas Explorer for Arid Land)\n\t"
                      "To exit, press q\n"
                      "Database Setup: \t\n")
@@ -14,11 +14,7 @@ def user_prompt():
         util.exit_TEAL(None)
 
     if defaults == 'y':
-        database_file = util.get_base_dir() / 'final_project/database/TEAL.sqlite'
-        land_csv = util.get_base_dir() / 'final_project/input/land.csv'
-        county_csv = util.get_base_dir() / 'final_project/input/county.csv'
-        owner_csv = util.get_base_dir() / 'final_project/input/owner.csv'
-        improvement_csv = util.get_base_dir() / 'final_project/input/improvement.csv'
+        database_file, land_csv, county_csv, owner_csv, improvement_csv = default_files()
 
     else:
         database_file = get_database("\tPlease provide a path to the database: ", None)
@@ -27,22 +23,71 @@ def user_prompt():
         owner_csv = get_csv("\tPlease provide land owner data: ", None)
         improvement_csv = get_csv("\tPlease provide land improvement data: ", None)
 
-    database = queries.Database(database_file)
-
-    database.load_land_data(land_csv)
-    database.load_county_data(county_csv)
-    database.load_owner_data(owner_csv)
-    database.load_improvement_data(improvement_csv)
+    persistent = input("\tKeep database between sessions (y/n): ").lower()
+    if persistent == 'q':
+        util.exit_TEAL(None)
 
-    sys.stdout.write('\tDatabase successfully initialized.\n')
+    database = load_database(database_file, land_csv, county_csv, owner_csv, improvement_csv,
+                             persistent == 'y', profile, in_memory, snapshot_seconds, shards)
 
     interact(database)
 
 
+def default_files():
+    database_file = util.get_base_dir() / 'final_project/database/TEAL.sqlite'
+    land_csv = util.get_base_dir() / 'final_project/input/land.csv'
+    county_csv = util.get_base_dir() / 'final_project/input/county.csv'
+    owner_csv = util.get_base_dir() / 'final_project/input/owner.csv'
+    improvement_csv = util.get_base_dir() / 'final_project/input/improvement.csv'
+    return database_file, land_csv, county_csv, owner_csv, improvement_csv
+
+
+def load_database(database_file, land_csv, county_csv, owner_csv, improvement_csv, persistent=False,
+                  profile=None, in_memory=False, snapshot_seconds=None, shards=None):
+    # memory and shard subclass or wrap queries.Database, which imports this
+    # module, so they are imported once queries has finished loading.
+    if shards and profile is not None:
+        raise ValueError('Profiling is not supported on a sharded database')
+    if shards and in_memory:
+        raise ValueError('A sharded database cannot run in memory')
+    if shards:
+        from final_project.TEAL import shard
+
+        database = shard.ShardedDatabase(database_file, persistent=persistent, shard_count=shards)
+    elif in_memory:
+        from final_project.TEAL import memory
+
+        database = memory.MemoryDatabase(database_file, persistent=persistent, snapshot_seconds=snapshot_seconds)
+    else:
+        database = queries.Database(database_file, persistent=persistent)
+    if profile is not None:
+        database.enable_profiling(**profile)
+
+    if shards:
+        # Shards are split up front; every statewide read needs all of them.
+        database.load_land_data(land_csv)
+        database.load_county_data(county_csv)
+        database.load_owner_data(owner_csv)
+        database.load_improvement_data(improvement_csv)
+    else:
+        # Each table is loaded the first time it is used.
+        database.register_source('land', land_csv)
+        database.register_source('county', county_csv)
+        database.register_source('owner', owner_csv)
+        database.register_source('improvement', improvement_csv)
+
+    sys.stdout.write('\tDatabase successfully initialized.\n')
+    return database
+
+
 def interact(database):
     select = selection_prompt()
 
     while select != 'q':
+        # Writes group commit has held past group_commit_ms are committed
+        # before the next command runs. Nothing else flushes a plain
+        # Database, so its newest write stays uncommitted until then.
+        database.flush()
         if select == 'i':
             input_prompt.initiate_insert(database)
         elif select == 'd':
@@ -0,0 +1,206 @@
+import argparse
+import csv
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from final_project.TEAL import queries
+
+DEFAULT_SIZES = (10 ** 4, 10 ** 5)
+
+COUNTY_COUNT = 64
+
+PARCELS_PER_OWNER = 50
+
+IMPROVEMENT_TYPES = (('grass', 0.15, 1), ('organic soil supplement', 5, 2), ('tillage', 14, 3),
+                     ('fertilizer', 2.74, 2), ('biodiversification', 50, 8), ('irrigation', 27, 6))
+
+# One entry per query_prompt.query_options selection, with fixed arguments.
+QUERIES = (('1_land_by_county', 'get_land_by_county', (3, 'County 3')),
+           ('2_land_by_area', 'get_land_by_area', (5, 10)),
+           ('3_land_by_owner', 'get_land_by_owner', (7, None)),
+           ('4_land_by_quality', 'get_land_by_quality_rating', (2, 4)),
+           ('5_land_details', 'view_land_details', ()),
+           ('6_average_rating_county', 'get_average_rating_county', ()),
+           ('7_area_by_owner', 'get_area_by_owner', ()),
+           ('8_owners_in_county', 'get_owners_in_county', (3, None)),
+           ('9_critical_land_count', 'get_critical_land_count_by_county', (2,)),
+           ('10_land_by_status', 'get_land_by_status', ('public',)),
+           ('11_generic_query', 'generic_query', ('land', False, 'rating', '< 3')))
+
+
+def generate(directory, parcels, seed=0, geometry=False):
+    # Same seed and size always give byte-identical CSVs, so runs on different
+    # commits measure the same data.
+    rng = random.Random(seed)
+    directory.mkdir(parents=True, exist_ok=True)
+    owners = max(1, parcels // PARCELS_PER_OWNER)
+
+    with (directory / 'county.csv').open('w', newline='') as county_csv:
+        writer = csv.writer(county_csv)
+        writer.writerow(['cid', 'name', 'pop2018', 'GrowthRate'])
+        for county_id in range(1, COUNTY_COUNT + 1):
+            writer.writerow([county_id, 'County ' + str(county_id), rng.randint(500, 750000),
+                             round(rng.uniform(-5, 20), 4)])
+
+    with (directory / 'owner.csv').open('w', newline='') as owner_csv:
+        writer = csv.writer(owner_csv)
+        writer.writerow(['oid', 'status', 'name'])
+        for owner_id in range(1, owners + 1):
+            writer.writerow([owner_id, 'public' if rng.random() < 0.3 else 'private', 'Owner ' + str(owner_id)])
+
+    with (directory / 'improvement.csv').open('w', newline='') as improvement_csv:
+        writer = csv.writer(improvement_csv)
+        writer.writerow(['mid', 'improvement_type', 'cost', 'improvement'])
+        for improvement_id, (improvement_type, cost, improvement) in enumerate(IMPROVEMENT_TYPES, 1):
+            writer.writerow([improvement_id, improvement_type, cost, improvement])
+
+    with (directory / 'land.csv').open('w', newline='') as land_csv:
+        writer = csv.writer(land_csv)
+        header = ['id', 'owner_id', 'mid', 'rating', 'area']
+        if geometry:
+            header += ['min_x', 'max_x', 'min_y', 'max_y']
+        writer.writerow(header)
+        # Parcels of a county cluster in one cell of an 8 x 8 grid.
+        for land_id in range(1, parcels + 1):
+            county_id = rng.randint(1, COUNTY_COUNT)
+            row = [land_id, rng.randint(1, owners), county_id, rng.randint(0, 8), rng.randint(1, 30)]
+            if geometry:
+                x = (county_id - 1) % 8 * 100 + rng.uniform(0, 100)
+                y = (county_id - 1) // 8 * 100 + rng.uniform(0, 100)
+                side = row[4] ** 0.5 / 10
+                row += ['%.4f' % x, '%.4f' % (x + side), '%.4f' % y, '%.4f' % (y + side)]
+            writer.writerow(row)
+    return directory
+
+
+def timed(repeat, action):
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = action()
+        samples.append(time.perf_counter() - start)
+    return {'seconds': min(samples), 'median_seconds': statistics.median(samples), 'repeat': repeat}, result
+
+
+def drain(database):
+    return sum(len(batch) for batch in database.iter_batches())
+
+
+def run(parcels, workdir, seed=0, repeat=3, insert_count=10000, geometry=False):
+    data_dir = generate(workdir / ('data_%d_%d' % (parcels, seed)), parcels, seed, geometry)
+    database_file = workdir / ('teal_%d.sqlite' % parcels)
+    if database_file.exists():
+        database_file.unlink()
+
+    results = {}
+    database = queries.Database(database_file)
+    for table_name in ('county', 'owner', 'improvement', 'land'):
+        timing, rows = timed(1, lambda: database.load_table(table_name, data_dir / (table_name + '.csv')))
+        timing['rows'] = rows
+        timing['rows_per_sec'] = rows / timing['seconds'] if timing['seconds'] else None
+        results['load_' + table_name] = timing
+
+    for name, method, args in QUERIES:
+        timing, rows = timed(repeat, lambda: (getattr(database, method)(*args), drain(database))[1])
+        timing['rows'] = rows
+        results['query_' + name] = timing
+
+    first_id = parcels + 1
+
+    def insert_parcels():
+        with database.transaction():
+            for land_id in range(first_id, first_id + insert_count):
+                database.insert_into_land(land_id, 1, land_id % COUNTY_COUNT + 1, land_id % 9, land_id % 30 + 1)
+        return insert_count
+
+    timing, rows = timed(1, insert_parcels)
+    timing['rows'] = rows
+    timing['rows_per_sec'] = rows / timing['seconds']
+    results['bulk_insert'] = timing
+
+    def delete_range():
+        with database.transaction():
+            last_id = first_id + insert_count - 1
+            return database.delete_where('land', queries.predicate.Between('id', first_id, last_id))
+
+    timing, rows = timed(1, delete_range)
+    timing['rows'] = rows
+    timing['rows_per_sec'] = rows / timing['seconds'] if timing['seconds'] else None
+    results['range_delete'] = timing
+
+    database.close()
+    return results
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=Path(__file__).resolve().parent, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, candidate_path, threshold=1.10):
+    with baseline_path.open('r') as baseline_file, candidate_path.open('r') as candidate_file:
+        baseline, candidate = json.load(baseline_file), json.load(candidate_file)
+
+    regressions = 0
+    for size, results in candidate['runs'].items():
+        for name, timing in results.items():
+            before = baseline['runs'].get(size, {}).get(name)
+            if before is None or not before['seconds']:
+                continue
+            ratio = timing['seconds'] / before['seconds']
+            flag = ' REGRESSION' if ratio > threshold else ''
+            regressions += bool(flag)
+            sys.stdout.write('%10s %-34s %10.4fs -> %10.4fs  x%.2f%s\n'
+                             % (size, name, before['seconds'], timing['seconds'], ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TEAL benchmark over synthetic parcel data')
+    parser.add_argument('--parcels', type=int, nargs='+', default=list(DEFAULT_SIZES),
+                        help='parcel counts to benchmark, e.g. 10000 1000000 10000000')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs per query; the fastest is reported')
+    parser.add_argument('--inserts', type=int, default=10000, help='parcels for the bulk insert and range delete')
+    parser.add_argument('--geometry', action='store_true', help='generate parcel bounding boxes')
+    parser.add_argument('--workdir', type=Path, default=Path('teal_benchmark'))
+    parser.add_argument('--output', type=Path, help='JSON results file (default: workdir/results_<commit>.json)')
+    parser.add_argument('--compare', type=Path, nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help='compare two results files instead of running')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    commit = current_commit()
+    report = {'commit': commit,
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+              'python': platform.python_version(),
+              'sqlite': sqlite3.sqlite_version,
+              'platform': platform.platform(),
+              'seed': args.seed,
+              'runs': {}}
+    for parcels in args.parcels:
+        sys.stdout.write('Benchmarking %d parcels\n' % parcels)
+        report['runs'][str(parcels)] = run(parcels, args.workdir, args.seed, args.repeat, args.inserts,
+                                           args.geometry)
+
+    output = args.output or args.workdir / ('results_%s.json' % (commit[:12] if commit else 'unknown'))
+    with output.open('w') as output_file:
+        json.dump(report, output_file, indent=1)
+    sys.stdout.write('Wrote ' + str(output) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,52 @@
-from final_project.TEAL import user_prompt
+import argparse
+from pathlib import Path
+from final_project import util
+from final_project.TEAL import user_prompt, batch, profiler
 
 
 def main():
-    user_prompt.user_prompt()
+    parser = argparse.ArgumentParser(description='TEAL (Texas Explorer for Arid Land)')
+    parser.add_argument('--batch', type=Path,
+                        help='run the insert/delete/search/query commands in this file instead of prompting')
+    parser.add_argument('--persistent', action='store_true',
+                        help='keep the database between runs and reload only changed CSVs')
+    parser.add_argument('--quiet', action='store_true',
+                        help='do not print query results in batch mode')
+    parser.add_argument('--profile', action='store_true',
+                        help='time every statement and print per-method latency histograms on exit')
+    parser.add_argument('--slow-ms', type=float, default=profiler.SLOW_QUERY_MS,
+                        help='statements slower than this many milliseconds go to the slow-query log')
+    parser.add_argument('--slow-log', type=Path,
+                        help='append slow statements with their query plans to this file (implies --profile)')
+    parser.add_argument('--profile-out', type=Path,
+                        help='write the profile summary as JSON to this file on exit (implies --profile)')
+    parser.add_argument('--memory', action='store_true',
+                        help='serve queries from an in-memory copy of the database, written back on exit')
+    parser.add_argument('--snapshot-seconds', type=float,
+                        help='with --memory, also write the in-memory database back this often')
+    parser.add_argument('--shards', type=int,
+                        help='split land by county_id across this many database files and fan statewide '
+                             'queries out to a process pool')
+    args = parser.parse_args()
+    if args.shards and (args.memory or args.snapshot_seconds is not None):
+        parser.error('--memory and --snapshot-seconds cannot be used with --shards')
+
+    profile = None
+    if args.profile or args.slow_log or args.profile_out:
+        if args.shards:
+            # Statements run on the shards' own connections, where the profiler cannot see them.
+            parser.error('--profile, --slow-log and --profile-out cannot be used with --shards')
+        profile = {'slow_ms': args.slow_ms, 'slow_log': args.slow_log, 'summary_path': args.profile_out}
+
+    if args.batch is None:
+        user_prompt.user_prompt(profile, args.memory, args.snapshot_seconds, args.shards)
+        return
+
+    database = user_prompt.load_database(*user_prompt.default_files(), persistent=args.persistent,
+                                         profile=profile, in_memory=args.memory,
+                                         snapshot_seconds=args.snapshot_seconds, shards=args.shards)
+    batch.run_file(database, args.batch, echo=not args.quiet)
+    util.exit_TEAL(database)
 
 
 if __name__ == '__main__':
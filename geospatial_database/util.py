@@ -1,4 +1,5 @@
 import sys
+import hashlib
 from pathlib import Path
 
 
@@ -10,8 +11,18 @@ def get_base_dir():
         return Path(__file__).resolve().parents[1]
 
 
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with path.open('rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
 def exit_TEAL(database):
     if database is not None:
-        database.conn.close()
+        if database.profiler is not None:
+            database.profiler.report()
+        database.close()
     sys.stdout.write("Exiting TEAL")
     sys.exit()